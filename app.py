@@ -1,16 +1,59 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, Response, stream_with_context, make_response, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 import os
 from dotenv import load_dotenv
-from functools import wraps
+from functools import wraps, lru_cache
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
+import base64
+import calendar
 import csv
+import hashlib
+import importlib
 import io
 import traceback
 import json
-from collections import Counter
+import multiprocessing
+import zlib
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import chain, islice
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import heapq
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import BigInteger, and_, bindparam, case, cast, delete, event, func, insert, literal_column, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class LazyModule:
+    """A module imported on first attribute access, keeping it off the startup path"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+# numpy is only needed once categorisation or analytics run
+np = LazyModule('numpy')
 
 # Load environment variables
 load_dotenv()
@@ -25,9 +68,37 @@ if DATABASE_URL.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
+app.config['INGEST_BATCH_SIZE'] = int(os.getenv('INGEST_BATCH_SIZE', '1000'))
+app.config['CATEGORY_INDEX_TTL'] = int(os.getenv('CATEGORY_INDEX_TTL', '60'))
+app.config['CATEGORY_HALF_LIFE_DAYS'] = float(os.getenv('CATEGORY_HALF_LIFE_DAYS', '180'))
+app.config['INGEST_WORKERS'] = int(os.getenv('INGEST_WORKERS', '2'))
+# Queued and running jobs are stamped this often; one unstamped for three intervals has lost its process
+app.config['INGEST_HEARTBEAT_SECONDS'] = int(os.getenv('INGEST_HEARTBEAT_SECONDS', '30'))
+app.config['PARSE_WORKERS'] = int(os.getenv('PARSE_WORKERS', str(os.cpu_count() or 1)))
+app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', '512'))
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', '300'))
+app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL')
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(tempfile.gettempdir(), 'budget_uploads'))
+app.config['SNAPSHOT_FOLDER'] = os.getenv('SNAPSHOT_FOLDER', os.path.join(tempfile.gettempdir(), 'budget_snapshots'))
+# Largest relative difference from its usual amount a recurring payment may have
+app.config['RECURRING_AMOUNT_TOLERANCE'] = float(os.getenv('RECURRING_AMOUNT_TOLERANCE', '0.2'))
+app.config['TRANSFER_WINDOW_DAYS'] = int(os.getenv('TRANSFER_WINDOW_DAYS', '3'))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+# Requests slower than this many milliseconds get a sampled profile written; 0 disables
+app.config['PROFILE_SLOW_REQUEST_MS'] = int(os.getenv('PROFILE_SLOW_REQUEST_MS', '0'))
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+app.config['PROFILE_FOLDER'] = os.getenv('PROFILE_FOLDER', os.path.join(tempfile.gettempdir(), 'budget_profiles'))
+# Connection pool, per process; size it for the gunicorn threads plus INGEST_WORKERS
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', '10'))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# PostgreSQL only; 0 leaves statements unlimited
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
+# Bound to the app by create_app()
+db = SQLAlchemy()
 
 # Define available categories
 CATEGORIES = [
@@ -59,6 +130,8 @@ class Account(db.Model):
     files = db.relationship('UploadedFile', backref='account', lazy=True)
     transactions = db.relationship('Transaction', backref='account', lazy=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every change to the account's transactions; keys cached responses
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class UploadedFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -75,14 +148,29 @@ class Transaction(db.Model):
     description1 = db.Column(db.String(500))
     description2 = db.Column(db.String(500))
     description3 = db.Column(db.String(500))
-    debit_amount = db.Column(db.Float)
-    credit_amount = db.Column(db.Float)
-    balance = db.Column(db.Float)
+    debit_amount = db.Column(db.Numeric(12, 2))
+    credit_amount = db.Column(db.Numeric(12, 2))
+    balance = db.Column(db.Numeric(12, 2))
     transaction_type = db.Column(db.String(50))
     category = db.Column(db.String(100), default="Uncategorized")
     file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Content hash used to skip rows already imported from an overlapping export
+    fingerprint = db.Column(db.String(40))
+    
+    __table_args__ = (
+        db.Index('ix_transaction_account_posted_date', 'account_id', 'posted_date'),
+        db.Index('ix_transaction_account_category', 'account_id', 'category'),
+        db.Index('ix_transaction_fingerprint', 'fingerprint', unique=True),
+        # Newest balance per account; partial, so accounts whose exports carry
+        # no balance (cards) have nothing to scan past
+        db.Index(
+            'ix_transaction_account_balance', 'account_id', 'posted_date', 'id',
+            postgresql_where=db.text('balance IS NOT NULL AND posted_date IS NOT NULL'),
+            sqlite_where=db.text('balance IS NOT NULL AND posted_date IS NOT NULL')
+        ),
+    )
     
     def to_dict(self):
         return {
@@ -92,9 +180,9 @@ class Transaction(db.Model):
             'description1': self.description1,
             'description2': self.description2,
             'description3': self.description3,
-            'debit_amount': self.debit_amount,
-            'credit_amount': self.credit_amount,
-            'balance': self.balance,
+            'debit_amount': money(self.debit_amount),
+            'credit_amount': money(self.credit_amount),
+            'balance': money(self.balance),
             'transaction_type': self.transaction_type,
             'category': self.category,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
@@ -110,26 +198,338 @@ class CategoryMapping(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('user_id', 'keyword', name='unique_user_keyword'),
+        db.Index('ix_category_mapping_user_keyword_count', 'user_id', 'keyword', 'count'),
+    )
+
+RULE_MATCH_TYPES = ('prefix', 'contains', 'regex')
+TRANSACTION_TYPES = ('debit', 'credit')
+
+class CategoryRule(db.Model):
+    """A user-defined categorisation rule; every condition that is set must hold"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    match_type = db.Column(db.String(20))  # prefix, contains or regex on description1
+    pattern = db.Column(db.String(255))
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'))
+    transaction_type = db.Column(db.String(10))  # debit or credit
+    min_amount = db.Column(db.Numeric(12, 2))
+    max_amount = db.Column(db.Numeric(12, 2))
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_category_rule_user', 'user_id'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'category': self.category,
+            'match_type': self.match_type,
+            'pattern': self.pattern,
+            'account_id': self.account_id,
+            'transaction_type': self.transaction_type,
+            'min_amount': money(self.min_amount),
+            'max_amount': money(self.max_amount),
+            'priority': self.priority
+        }
+
+class IngestJob(db.Model):
+    """A CSV import running in the background, polled through /api/jobs/<id>"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    rows_per_second = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # Last time the process holding the job confirmed it is alive
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'file_id': self.file_id,
+            'account_id': self.account_id,
+            'rows': self.rows,
+            'transactions_count': self.inserted,
+            'skipped_count': self.skipped,
+            'rows_per_second': self.rows_per_second,
+            'error': self.error,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
+# Month key used for transactions without a posted date
+NO_MONTH = ''
+
+# Lowercased descriptions as one text; PostgreSQL indexes exactly this
+# expression with pg_trgm, so queries must spell it the same way
+SEARCH_TEXT_SQL = (
+    "lower(coalesce(description1, '') || ' ' || coalesce(description2, '') || ' ' || coalesce(description3, ''))"
+)
+
+class MonthlyRollup(db.Model):
+    """Spending and income totals per account, month ('YYYY-MM') and category"""
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)
+    category = db.Column(db.String(100), nullable=False)
+    spending = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    income = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'month', 'category', name='unique_account_month_category'),
     )
 
+# Per-thread count of SQL statements and seconds spent in them, used to
+# report queries per upload and per request
+query_counter = threading.local()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    query_counter.count = getattr(query_counter, 'count', 0) + 1
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    query_counter.seconds = getattr(query_counter, 'seconds', 0.0) + elapsed
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+class PhaseTimings:
+    """Wall-clock seconds per named phase of a pipeline.
+    
+    Phases nest; each one is charged only for the time not spent in the
+    phases inside it, so the totals add up to the time measured.
+    """
+    
+    def __init__(self):
+        self.seconds = Counter()
+        self.nested = []
+    
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            self.finish(name, time.perf_counter() - started)
+    
+    def finish(self, name, elapsed):
+        self.seconds[name] += elapsed - self.nested.pop()
+        if self.nested:
+            self.nested[-1] += elapsed
+    
+    def iterate(self, name, iterable):
+        """Yield from an iterable, charging the time to produce each item to a phase"""
+        iterator = iter(iterable)
+        perf_counter = time.perf_counter
+        while True:
+            started = perf_counter()
+            self.nested.append(0.0)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.finish(name, perf_counter() - started)
+                return
+            except BaseException:
+                self.finish(name, perf_counter() - started)
+                raise
+            self.finish(name, perf_counter() - started)
+            yield item
+    
+    def as_dict(self):
+        return {name: round(seconds, 4) for name, seconds in self.seconds.items()}
+
+def current_timings():
+    """The current request's phase timings, or a fresh set outside a request"""
+    if has_request_context() and 'timings' in g:
+        return g.timings
+    return PhaseTimings()
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+    
+    Values live in this process, so each gunicorn worker reports its own
+    share; Prometheus sums them across scrape targets.
+    """
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = defaultdict(float)
+        self.histograms = {}
+    
+    def counter(self, name, help_text):
+        self.help[name] = ('counter', help_text)
+    
+    def histogram(self, name, help_text):
+        self.help[name] = ('histogram', help_text)
+    
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+    
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        pairs = []
+        for name, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+    
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(buckets), total, count)) for key, (buckets, total, count) in self.histograms.items()
+            )
+        
+        lines = []
+        for name, (kind, help_text) in sorted(self.help.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in counters:
+                    if metric == name:
+                        lines.append(f'{name}{self.format_labels(labels)} {value:g}')
+            else:
+                for (metric, labels), (buckets, total, count) in histograms:
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.BUCKETS, buckets):
+                        bucket_labels = self.format_labels(labels + (('le', f'{bound:g}'),))
+                        lines.append(f'{name}_bucket{bucket_labels} {bucket_count}')
+                    lines.append(f'{name}_bucket{self.format_labels(labels + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{self.format_labels(labels)} {total:g}')
+                    lines.append(f'{name}_count{self.format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.counter('budget_http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('budget_http_request_duration_seconds', 'Time to produce a response, by endpoint.')
+metrics.counter('budget_db_queries_total', 'SQL statements executed while serving requests, by endpoint.')
+metrics.counter('budget_db_seconds_total', 'Seconds spent in SQL statements while serving requests, by endpoint.')
+metrics.counter('budget_upload_rows_total', 'CSV rows read by uploads.')
+metrics.counter('budget_upload_phase_seconds_total', 'Seconds spent in each upload pipeline phase.')
+
+class SamplingProfiler:
+    """Samples the Python stacks of in-flight requests from one background thread.
+    
+    Stacks are folded into "outer;...;inner count" lines, the input format of
+    flamegraph.pl and speedscope.
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def start(self, thread_id):
+        with self.lock:
+            self.active[thread_id] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+                self.thread.start()
+    
+    def stop(self, thread_id):
+        with self.lock:
+            return self.active.pop(thread_id, None)
+    
+    @staticmethod
+    def fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+    
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.fold(frame)] += 1
+
+profiler = SamplingProfiler(app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+
+# Supported date formats, in order of preference when several fit
+DATE_FORMATS = [
+    '%Y-%m-%d',   # 2023-01-15
+    '%d/%m/%Y',   # 15/01/2023
+    '%m/%d/%Y',   # 01/15/2023
+    '%d-%m-%Y',   # 15-01-2023
+    '%d-%b-%Y',   # 15-Jan-2023
+    '%d %b %Y',   # 15 Jan 2023
+    '%b %d, %Y',  # Jan 15, 2023
+    '%d.%m.%Y',   # 15.01.2023
+    '%Y/%m/%d'    # 2023/01/15
+]
+
+# Purely numeric formats parsed by splitting on the separator instead of strptime:
+# format -> (separator, positions of year, month, day)
+NUMERIC_DATE_FORMATS = {
+    '%Y-%m-%d': ('-', (0, 1, 2)),
+    '%d/%m/%Y': ('/', (2, 1, 0)),
+    '%m/%d/%Y': ('/', (2, 0, 1)),
+    '%d-%m-%Y': ('-', (2, 1, 0)),
+    '%d.%m.%Y': ('.', (2, 1, 0)),
+    '%Y/%m/%d': ('/', (0, 1, 2))
+}
+
+# Rows sampled from the top of a file to pick its date format
+DATE_SAMPLE_ROWS = 200
+
+class DateFormatError(ValueError):
+    """A file's dates do not follow one consistent format"""
+
 # Parse date with multiple possible formats
 def parse_date(date_str):
     if not date_str or date_str.strip() == '':
         return None
-        
-    date_formats = [
-        '%Y-%m-%d',   # 2023-01-15
-        '%d/%m/%Y',   # 15/01/2023
-        '%m/%d/%Y',   # 01/15/2023
-        '%d-%m-%Y',   # 15-01-2023
-        '%d-%b-%Y',   # 15-Jan-2023
-        '%d %b %Y',   # 15 Jan 2023
-        '%b %d, %Y',  # Jan 15, 2023
-        '%d.%m.%Y',   # 15.01.2023
-        '%Y/%m/%d'    # 2023/01/15
-    ]
-    
-    for fmt in date_formats:
+    
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(date_str, fmt).date()
         except ValueError:
@@ -137,6 +537,69 @@ def parse_date(date_str):
     
     return None
 
+def infer_date_format(values):
+    """Pick the one date format that fits every sampled value.
+    
+    Day/month order is settled by values that only fit one way (a day above
+    12); when the sample gives no such evidence, day-first wins as before.
+    """
+    values = {value.strip() for value in values if value and value.strip()}
+    if not values:
+        return None
+    
+    for fmt in DATE_FORMATS:
+        try:
+            for value in values:
+                datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return fmt
+    
+    examples = ', '.join(sorted(values)[:5])
+    raise DateFormatError(f"Dates do not share a single supported format (e.g. {examples})")
+
+def make_date_parser(fmt):
+    """Return a function parsing date strings in one known format.
+    
+    Each distinct string is parsed once; bank exports repeat the same few dates
+    on many rows. A value in any other format raises DateFormatError.
+    """
+    if fmt is None:
+        return parse_date
+    
+    cache = {}
+    numeric = NUMERIC_DATE_FORMATS.get(fmt)
+    
+    def parse(date_str):
+        if not date_str:
+            return None
+        
+        parsed = cache.get(date_str)
+        if parsed is not None:
+            return parsed
+        
+        value = date_str.strip()
+        if not value:
+            return None
+        try:
+            if numeric:
+                separator, (year, month, day) = numeric
+                parts = value.split(separator)
+                if len(parts) != 3 or len(parts[year]) != 4:
+                    raise ValueError(value)
+                parsed = date(int(parts[year]), int(parts[month]), int(parts[day]))
+            else:
+                parsed = datetime.strptime(value, fmt).date()
+        except ValueError:
+            raise DateFormatError(
+                f"Date '{value}' does not match the {fmt} format used by the rest of the file"
+            )
+        
+        cache[date_str] = parsed
+        return parsed
+    
+    return parse
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -146,6 +609,194 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Response cache for read endpoints, keyed on the account's data_version so
+# any write to the account makes its old entries unreachable
+
+class ResponseCache:
+    """Bounded in-process LRU store whose entries also expire after a TTL"""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class RedisResponseCache:
+    """Response store shared by every gunicorn worker through Redis"""
+    
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+    
+    def get(self, key):
+        payload = self.client.get(f'response:{key}')
+        return json.loads(payload) if payload else None
+    
+    def set(self, key, value):
+        self.client.set(f'response:{key}', json.dumps(value), ex=self.ttl)
+
+def create_response_cache():
+    """Use Redis when CACHE_REDIS_URL is set and the client is installed"""
+    ttl = app.config['RESPONSE_CACHE_TTL']
+    if app.config['CACHE_REDIS_URL']:
+        try:
+            import redis
+            return RedisResponseCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']), ttl)
+        except ImportError:
+            app.logger.warning("CACHE_REDIS_URL is set but redis is not installed; using the in-process cache")
+    return ResponseCache(app.config['RESPONSE_CACHE_SIZE'], ttl)
+
+# Created by create_app() from the configured backend
+response_cache = None
+
+def cached_response(f):
+    """Cache a per-account GET view and answer If-None-Match with 304.
+    
+    The account's data_version comes back with the ownership check, so a
+    matching ETag is answered without running the view's queries.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        account_id = request.args.get('account_id')
+        version = None
+        if account_id and account_id.isdigit():
+            version = db.session.execute(
+                select(Account.data_version).where(
+                    Account.id == int(account_id),
+                    Account.user_id == session['user_id']
+                )
+            ).scalar()
+        if version is None:
+            return f(*args, **kwargs)
+        return serve_cached(f'{account_id}:{version}', f, args, kwargs)
+    return decorated_function
+
+def cached_household_response(f):
+    """Cache a GET view over all of the user's accounts.
+    
+    Account versions only ever grow, so the number of accounts and the sum of
+    their versions change whenever any account's data does.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        count, total = db.session.execute(
+            select(func.count(Account.id), func.coalesce(func.sum(Account.data_version), 0))
+            .where(Account.user_id == session['user_id'])
+        ).one()
+        return serve_cached(f'all:{count}.{total}', f, args, kwargs)
+    return decorated_function
+
+def serve_cached(scope, f, args, kwargs):
+    """Answer from the response cache or with 304, running the view only on a miss"""
+    params = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    key = f"{session['user_id']}:{scope}:{request.endpoint}:{params}"
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cached = response_cache.get(key)
+        if cached is None:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            headers = {name: response.headers[name]
+                       for name in ('X-Next-Cursor', 'Link') if name in response.headers}
+            cached = [response.get_data(as_text=True), headers]
+            response_cache.set(key, cached)
+        body, headers = cached
+        response = Response(body, mimetype='application/json', headers=headers)
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def bump_account_version(account_id):
+    """Invalidate every cached response for an account"""
+    db.session.execute(
+        update(Account).where(Account.id == int(account_id)).values(data_version=Account.data_version + 1)
+    )
+
+# Request instrumentation: timing, SQL counts and DB time for every request,
+# reported in a Server-Timing header and the /metrics counters
+
+@app.before_request
+def start_request_timer():
+    g.timings = PhaseTimings()
+    g.request_started = time.perf_counter()
+    g.queries_before = getattr(query_counter, 'count', 0)
+    g.db_seconds_before = getattr(query_counter, 'seconds', 0.0)
+    if app.config['PROFILE_SLOW_REQUEST_MS'] > 0:
+        profiler.start(threading.get_ident())
+
+@app.after_request
+def record_request_timing(response):
+    """Add Server-Timing and update metrics; streamed bodies count up to the first byte"""
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    queries = getattr(query_counter, 'count', 0) - g.queries_before
+    db_seconds = getattr(query_counter, 'seconds', 0.0) - g.db_seconds_before
+    endpoint = request.endpoint or 'none'
+    
+    timings = [f'app;dur={elapsed * 1000:.1f}', f'db;dur={db_seconds * 1000:.1f};desc="{queries} queries"']
+    timings += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in g.timings.seconds.items()]
+    response.headers['Server-Timing'] = ', '.join(timings)
+    
+    metrics.inc('budget_http_requests_total', {
+        'endpoint': endpoint, 'method': request.method, 'status': response.status_code
+    })
+    metrics.observe('budget_http_request_duration_seconds', {'endpoint': endpoint}, elapsed)
+    metrics.inc('budget_db_queries_total', {'endpoint': endpoint}, queries)
+    metrics.inc('budget_db_seconds_total', {'endpoint': endpoint}, db_seconds)
+    
+    samples = profiler.stop(threading.get_ident())
+    if samples and elapsed * 1000 >= app.config['PROFILE_SLOW_REQUEST_MS']:
+        write_profile(endpoint, elapsed, samples)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exception=None):
+    # after_request does not run when a response could not be built
+    profiler.stop(threading.get_ident())
+
+def write_profile(endpoint, elapsed, samples):
+    """Save a slow request's sampled stacks as a folded-stack file"""
+    os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+    filename = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{endpoint}-{round(elapsed * 1000)}ms-{uuid.uuid4().hex[:6]}.folded"
+    path = os.path.join(app.config['PROFILE_FOLDER'], filename)
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    app.logger.warning(f"Slow request {request.method} {request.path} took {elapsed * 1000:.0f}ms, profile saved to {path}")
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, query and upload metrics in the Prometheus text format"""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Routes
 @app.route('/')
 @login_required
@@ -189,6 +840,85 @@ def get_accounts():
     accounts = Account.query.filter_by(user_id=session['user_id']).all()
     return jsonify([{'id': a.id, 'name': a.name} for a in accounts])
 
+@app.route('/api/accounts/summary', methods=['GET'])
+@login_required
+@cached_household_response
+def account_summaries():
+    """Dashboard figures for every account of the user, in one query.
+    
+    Transaction counts and the month's spending and income are summed from
+    monthly_rollup. The last transaction date and the newest balance by
+    posted date are index lookups, so the cost grows with the number of
+    accounts, not transactions. month (YYYY-MM) defaults to the current one.
+    """
+    month = request.args.get('month') or date.today().strftime('%Y-%m')
+    if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', month):
+        return jsonify({'error': 'Invalid month, expected YYYY-MM'}), 400
+    
+    in_month = MonthlyRollup.month == month
+    totals = (
+        select(
+            MonthlyRollup.account_id,
+            func.sum(MonthlyRollup.transaction_count).label('transaction_count'),
+            func.sum(case((in_month, MonthlyRollup.spending), else_=0)).label('spending'),
+            func.sum(case((in_month, MonthlyRollup.income), else_=0)).label('income')
+        )
+        .join(Account, MonthlyRollup.account_id == Account.id)
+        .where(Account.user_id == session['user_id'])
+        .group_by(MonthlyRollup.account_id)
+        .subquery()
+    )
+    last_date = (
+        select(func.max(Transaction.posted_date))
+        .where(Transaction.account_id == Account.id)
+        .correlate(Account)
+        .scalar_subquery()
+    )
+    newest_balance_id = (
+        select(Transaction.id)
+        .where(
+            Transaction.account_id == Account.id,
+            Transaction.balance.isnot(None),
+            Transaction.posted_date.isnot(None)
+        )
+        .order_by(Transaction.posted_date.desc(), Transaction.id.desc())
+        .limit(1)
+        .correlate(Account)
+        .scalar_subquery()
+    )
+    latest = aliased(Transaction)
+    rows = db.session.execute(
+        select(
+            Account.id, Account.name, totals.c.transaction_count, totals.c.spending, totals.c.income,
+            last_date.label('last_date'), latest.balance, latest.posted_date
+        )
+        .outerjoin(totals, totals.c.account_id == Account.id)
+        .outerjoin(latest, latest.id == newest_balance_id)
+        .where(Account.user_id == session['user_id'])
+        .order_by(Account.id)
+    ).all()
+    
+    return jsonify([{
+        'id': account_id,
+        'name': name,
+        'transaction_count': int(count or 0),
+        'last_transaction_date': format_date(last_date),
+        'latest_balance': money(balance),
+        'balance_date': format_date(balance_date),
+        'month': month,
+        'month_spending': round(float(spending or 0), 2),
+        'month_income': round(float(income or 0), 2)
+    } for account_id, name, count, spending, income, last_date, balance, balance_date in rows])
+
+def format_date(value):
+    """'YYYY-MM-DD' for a date, or None"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # SQLite returns aggregates of date columns as text
+        return value[:10]
+    return value.strftime('%Y-%m-%d')
+
 @app.route('/accounts', methods=['POST'])
 @login_required
 def create_account():
@@ -233,189 +963,1141 @@ def upload_file():
     db.session.add(uploaded_file)
     db.session.commit()
     
-    # Read and process CSV file
-    try:
-        # Process CSV file
-        csv_content = file.read().decode('utf-8')
-        csv_file = io.StringIO(csv_content)
-        
-        # Try to determine dialect
-        sample = csv_file.read(1024)
-        csv_file.seek(0)
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(sample)
-        has_header = sniffer.has_header(sample)
+    # By default the file is stored and imported by a background worker;
+    # wait=true imports it within this request instead
+    if request.form.get('wait', '').lower() not in ('1', 'true', 'yes'):
+        job = IngestJob(user_id=session['user_id'], account_id=account.id, file_id=uploaded_file.id)
+        db.session.add(job)
+        db.session.commit()
         
-        transactions = []
-        
-        if has_header:
-            reader = csv.DictReader(csv_file, dialect=dialect)
-            for row in reader:
-                transactions.extend(process_row(row, uploaded_file.id, account_id))
-        else:
-            # If no header, fall back to default processing
-            reader = csv.reader(csv_file, dialect=dialect)
-            headers = next(reader, None)  # Skip first row
-            for row in reader:
-                row_dict = dict(zip(headers, row))
-                transactions.extend(process_row(row_dict, uploaded_file.id, account_id))
-        
-        # Apply category suggestions to new transactions
-        for transaction in transactions:
-            suggested_category = suggest_category(transaction.description1, session['user_id'])
-            if suggested_category:
-                transaction.category = suggested_category
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        path = upload_path(job.id)
+        file.save(path)
+        submit_ingest_job(job.id, path)
         
-        if transactions:
-            db.session.add_all(transactions)
-            db.session.commit()
+        return jsonify({
+            'message': 'File queued for processing',
+            'file_id': uploaded_file.id,
+            'job_id': job.id,
+            'status_url': url_for('get_job', job_id=job.id)
+        }), 202
+    
+    # Stream the CSV into the transaction table
+    try:
+        stats = ingest_csv(file.stream, uploaded_file.id, account_id, session['user_id'])
+        schedule_snapshot_refresh(session['user_id'])
         
         return jsonify({
             'message': 'File uploaded successfully', 
             'file_id': uploaded_file.id,
-            'transactions_count': len(transactions)
+            'transactions_count': stats['inserted'],
+            'skipped_count': stats['skipped'],
+            'db_queries': stats['db_queries'],
+            'elapsed_seconds': stats['elapsed_seconds'],
+            'rows_per_second': stats['rows_per_second'],
+            'peak_rss_kb': stats['peak_rss_kb'],
+            'phases': stats['phases']
         })
     
+    except DateFormatError as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error processing CSV: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error processing CSV: {str(e)}")
         app.logger.error(traceback.format_exc())
         return jsonify({'error': f'Error processing CSV: {str(e)}'}), 500
 
-def process_row(row, file_id, account_id):
-    """Process a CSV row and return one or more Transaction objects"""
-    transactions = []
+def normalize_account_name(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+# Parse processes for batch uploads, started on first use in each worker.
+# They are spawned rather than forked, so they do not inherit the worker's
+# threads, locks or database connections.
+parse_pool = None
+parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    global parse_pool
+    with parse_pool_lock:
+        # A pool whose process died refuses new work; start a fresh one
+        if parse_pool is None or parse_pool._broken:
+            parse_pool = ProcessPoolExecutor(
+                max_workers=app.config['PARSE_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return parse_pool
+
+@app.route('/upload/batch', methods=['POST'])
+@login_required
+def upload_files():
+    """Import several CSV exports (or a zip of them) in one transaction.
     
-    # Log the column names we received
-    app.logger.info(f"CSV columns: {list(row.keys())}")
+    Files are parsed in parallel across a process pool and written together,
+    so either every file is imported or none is. Each file goes to the
+    account given for it in the optional `mapping` JSON field
+    ({"filename.csv": account_id}), otherwise to the account whose name
+    matches the file name ignoring case and punctuation (loan1.csv -> Loan 1).
+    """
+    user_id = session['user_id']
+    accounts = Account.query.filter_by(user_id=user_id).all()
+    accounts_by_id = {account.id: account for account in accounts}
+    accounts_by_name = {normalize_account_name(account.name): account for account in accounts}
     
     try:
-        # Attempt to normalize column names
-        normalized_row = {}
-        for key, value in row.items():
-            if key:  # Skip empty keys
-                normalized_key = key.lower().strip().replace(' ', '_')
-                normalized_row[normalized_key] = value
-        
-        # Create a mapping for common column names
-        date_fields = ['date', 'posted_date', 'transaction_date', 'posting_date']
-        account_fields = ['account', 'posted_account', 'account_number']
-        description_fields = ['description', 'transaction_description', 'details', 'narrative']
-        debit_fields = ['debit', 'debit_amount', 'withdrawal', 'amount_out']
-        credit_fields = ['credit', 'credit_amount', 'deposit', 'amount_in']
-        balance_fields = ['balance', 'running_balance', 'current_balance']
-        
-        # Extract values using potential column names
-        date_str = find_first_value(normalized_row, date_fields)
-        account_name = find_first_value(normalized_row, account_fields)
-        description = find_first_value(normalized_row, description_fields)
-        
-        debit_str = find_first_value(normalized_row, debit_fields)
-        credit_str = find_first_value(normalized_row, credit_fields)
-        balance_str = find_first_value(normalized_row, balance_fields)
-        
-        # Handle case where there's a single amount column with positive/negative values
-        amount_str = find_first_value(normalized_row, ['amount', 'value', 'transaction_amount'])
-        if amount_str and not (debit_str or credit_str):
+        mapping = json.loads(request.form.get('mapping') or '{}')
+    except ValueError:
+        mapping = None
+    if not isinstance(mapping, dict):
+        return jsonify({'error': 'mapping must be a JSON object'}), 400
+    for filename, account_id in mapping.items():
+        if isinstance(account_id, bool) or not isinstance(account_id, (int, str)) or not str(account_id).isdigit():
+            return jsonify({'error': f'mapping for {filename} must be an account id'}), 400
+    
+    # Collect (filename, bytes) for every CSV, unpacking zip archives
+    uploads = []
+    for file in request.files.getlist('files'):
+        if file.filename.lower().endswith('.zip'):
             try:
-                amount = float(amount_str.replace(',', ''))
-                if amount < 0:
-                    debit_str = str(abs(amount))
-                    credit_str = '0'
-                else:
-                    credit_str = str(amount)
-                    debit_str = '0'
-            except (ValueError, TypeError):
-                pass
-        
-        # Parse numerical values
-        debit_amount = parse_float(debit_str)
-        credit_amount = parse_float(credit_str)
-        balance = parse_float(balance_str)
-        
-        # Create the transaction
-        transaction = Transaction(
-            posted_date=parse_date(date_str),
-            posted_account=account_name,
-            description1=description,
-            description2=row.get('Description2', ''),
-            description3=row.get('Description3', ''),
-            debit_amount=debit_amount,
-            credit_amount=credit_amount,
-            balance=balance,
-            transaction_type=row.get('Transaction Type', ''),
-            file_id=file_id,
-            account_id=account_id
-        )
-        transactions.append(transaction)
+                with zipfile.ZipFile(file.stream) as archive:
+                    for info in archive.infolist():
+                        name = os.path.basename(info.filename)
+                        if info.is_dir() or not name.lower().endswith('.csv') or name.startswith('.'):
+                            continue
+                        uploads.append((name, archive.read(info)))
+            except zipfile.BadZipFile:
+                return jsonify({'error': f'{file.filename} is not a valid zip file'}), 400
+        elif file.filename.lower().endswith('.csv'):
+            uploads.append((file.filename, file.read()))
+        else:
+            return jsonify({'error': f'{file.filename}: only CSV or zip files are allowed'}), 400
+    
+    if not uploads:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    targets = []
+    for filename, data in uploads:
+        account_id = mapping.get(filename)
+        if account_id is not None:
+            account = accounts_by_id.get(int(account_id))
+        else:
+            account = accounts_by_name.get(normalize_account_name(os.path.splitext(filename)[0]))
+        if not account:
+            return jsonify({'error': f'No account found for {filename}'}), 400
+        targets.append((filename, data, account))
+    
+    started = time.perf_counter()
+    timings = current_timings()
+    try:
+        # Parse every file in parallel; each worker returns plain dicts.
+        # Decoding happens in the workers, so it is all timed as parse here.
+        arguments = ([data for _, data, _ in targets], [account.id for _, _, account in targets])
+        with timings.phase('parse'):
+            if len(targets) > 1 and app.config['PARSE_WORKERS'] > 1:
+                results = get_parse_pool().map(parse_csv_bytes, *arguments)
+            else:
+                results = map(parse_csv_bytes, *arguments)
+            # Results arrive in file order, so a failure belongs to the next file
+            parsed = []
+            try:
+                for result in results:
+                    parsed.append(result)
+            except DateFormatError as e:
+                return jsonify({'error': f'Error processing {targets[len(parsed)][0]}: {str(e)}'}), 400
+        parse_seconds = time.perf_counter() - started
+        # Seconds the files took to parse, added up; over the wall time of the
+        # parse phase this is how many files the pool parsed at once
+        serial_parse_seconds = sum(seconds for _, seconds in parsed)
         
+        # One transaction for all files
+        category_index = get_category_index(user_id)
+        rules = get_category_rules(user_id)
+        results = []
+        for (filename, _, account), (transactions, _) in zip(targets, parsed):
+            uploaded_file = UploadedFile(filename=filename, account_id=account.id, user_id=user_id)
+            db.session.add(uploaded_file)
+            db.session.flush()
+            
+            inserted = 0
+            for batch in chunked(transactions, app.config['INGEST_BATCH_SIZE']):
+                for transaction in batch:
+                    transaction['file_id'] = uploaded_file.id
+                inserted += store_batch(batch, account.id, category_index, rules, timings)
+            results.append({
+                'filename': filename,
+                'account_id': account.id,
+                'file_id': uploaded_file.id,
+                'rows': len(transactions),
+                'transactions_count': inserted,
+                'skipped_count': len(transactions) - inserted
+            })
+        with timings.phase('commit'):
+            db.session.commit()
+        record_upload_metrics(sum(r['rows'] for r in results), timings)
+        schedule_snapshot_refresh(user_id)
+    
     except Exception as e:
-        app.logger.error(f"Error processing row: {str(e)}")
-        app.logger.error(f"Row data: {row}")
+        db.session.rollback()
+        app.logger.error(f"Error processing CSV batch: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'error': f'Error processing CSV: {str(e)}'}), 500
     
-    return transactions
+    return jsonify({
+        'message': 'Files uploaded successfully',
+        'files': results,
+        'transactions_count': sum(r['transactions_count'] for r in results),
+        'skipped_count': sum(r['skipped_count'] for r in results),
+        'parse_seconds': round(parse_seconds, 3),
+        'serial_parse_seconds': round(serial_parse_seconds, 3),
+        'pool_parallelism': round(serial_parse_seconds / parse_seconds, 2) if parse_seconds > 0 else None,
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        'phases': timings.as_dict()
+    })
 
-def find_first_value(row_dict, possible_keys):
-    """Find the first non-empty value from a list of possible keys"""
-    for key in possible_keys:
-        for col in row_dict:
-            if key in col.lower():
-                value = row_dict[col]
-                if value and value.strip():
-                    return value
-    return None
+# Background import workers, created by create_app(); threads start lazily
+# so this is safe before a fork
+ingest_executor = None
 
-def parse_float(value_str):
-    """Parse a string to float, handling various formats"""
-    if not value_str or not isinstance(value_str, str):
-        return 0.0
+# Jobs queued or running in this process; the heartbeat thread stamps them
+# so that jobs left behind by a process that died (a timeout, a recycled
+# worker, a deploy) can be told apart and failed rather than polled forever
+ACTIVE_JOB_STATUSES = ('queued', 'running')
+active_jobs = set()
+active_jobs_lock = threading.Lock()
+heartbeat_thread = None
+
+def upload_path(job_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f'{job_id}.csv')
+
+def submit_ingest_job(job_id, path):
+    with active_jobs_lock:
+        active_jobs.add(job_id)
+    start_ingest_heartbeat()
+    ingest_executor.submit(run_ingest_job, job_id, path)
+
+def start_ingest_heartbeat():
+    """Start this process's heartbeat thread if it is not running; gunicorn calls this as each worker starts"""
+    global heartbeat_thread
+    with active_jobs_lock:
+        # Threads do not survive a fork, so a worker never sees its parent's as alive
+        if heartbeat_thread is None or not heartbeat_thread.is_alive():
+            heartbeat_thread = threading.Thread(target=ingest_heartbeat, name='ingest-heartbeat', daemon=True)
+            heartbeat_thread.start()
+
+def ingest_heartbeat():
+    """Stamp this process's jobs and fail other processes' abandoned ones, every INGEST_HEARTBEAT_SECONDS"""
+    while True:
+        try:
+            with app.app_context():
+                with active_jobs_lock:
+                    job_ids = list(active_jobs)
+                if job_ids:
+                    db.session.execute(
+                        update(IngestJob)
+                        .where(IngestJob.id.in_(job_ids), IngestJob.status.in_(ACTIVE_JOB_STATUSES))
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+                    db.session.commit()
+                expire_stale_jobs()
+        except Exception as e:
+            app.logger.error(f"Ingest heartbeat failed: {str(e)}")
+        time.sleep(app.config['INGEST_HEARTBEAT_SECONDS'])
+
+def stale_job_cutoff():
+    return datetime.utcnow() - timedelta(seconds=3 * app.config['INGEST_HEARTBEAT_SECONDS'])
+
+def expire_stale_jobs():
+    """Fail queued and running jobs whose process stopped stamping them, and remove stored uploads of finished jobs.
     
-    # Remove currency symbols, commas, etc.
-    clean_value = value_str.replace('$', '').replace('£', '').replace('€', '').replace(',', '')
-    clean_value = clean_value.replace('(', '-').replace(')', '')
+    Batches committed before the process died stay; uploading the file again
+    skips them through their fingerprints.
+    """
+    stale = IngestJob.query.filter(
+        IngestJob.status.in_(ACTIVE_JOB_STATUSES),
+        func.coalesce(IngestJob.heartbeat_at, IngestJob.created_at) < stale_job_cutoff()
+    ).all()
+    for job in stale:
+        app.logger.warning(f"Job {job.id} was abandoned while {job.status}; marking it failed")
+        job.status = 'failed'
+        job.error = 'The import was interrupted by a server restart; upload the file again'
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
+    
+    # Uploads whose job has finished; files of unknown jobs may belong to another database
+    folder = app.config['UPLOAD_FOLDER']
+    stored = {name[:-len('.csv')] for name in os.listdir(folder) if name.endswith('.csv')} if os.path.isdir(folder) else set()
+    if stored:
+        finished = db.session.execute(
+            select(IngestJob.id).where(IngestJob.id.in_(stored), IngestJob.status.not_in(ACTIVE_JOB_STATUSES))
+        ).scalars()
+        for job_id in finished:
+            try:
+                os.remove(upload_path(job_id))
+            except OSError:
+                pass
+    return len(stale)
+
+def run_ingest_job(job_id, path):
+    """Import a stored upload in a worker thread, recording progress on its job row.
     
+    Each batch is committed with the progress update, so other gunicorn workers
+    can report it. A failed job leaves the batches committed so far; uploading
+    the file again skips them through their fingerprints. The job's status only
+    moves queued -> running -> done or failed, so a job another process has
+    already given up on (see expire_stale_jobs) is never picked up or revived.
+    """
+    with app.app_context():
+        claimed = db.session.execute(
+            update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            app.logger.warning(f"Job {job_id} is no longer queued; not importing it")
+            finish_ingest_job(job_id, path)
+            return
+        
+        job = db.session.get(IngestJob, job_id)
+        started = time.perf_counter()
+        
+        def progress(rows, inserted):
+            job.rows = rows
+            job.inserted = inserted
+            job.skipped = rows - inserted
+            elapsed = time.perf_counter() - started
+            job.rows_per_second = round(rows / elapsed) if elapsed > 0 else None
+            db.session.commit()
+        
+        outcome = {'status': 'failed'}
+        try:
+            with open(path, 'rb') as stream:
+                stats = ingest_csv(stream, job.file_id, job.account_id, job.user_id, progress=progress)
+            db.session.commit()
+            outcome = {
+                'status': 'done',
+                'rows': stats['rows'],
+                'inserted': stats['inserted'],
+                'skipped': stats['skipped'],
+                'rows_per_second': stats['rows_per_second']
+            }
+            app.logger.info(f"Job {job_id} imported {stats['rows']} rows, phase seconds: {stats['phases']}")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error processing CSV for job {job_id}: {str(e)}")
+            app.logger.error(traceback.format_exc())
+            outcome['error'] = f'Error processing CSV: {str(e)}'
+        finally:
+            finished = db.session.execute(
+                update(IngestJob)
+                .where(IngestJob.id == job_id, IngestJob.status == 'running')
+                .values(finished_at=datetime.utcnow(), **outcome)
+            ).rowcount
+            db.session.commit()
+            if not finished:
+                app.logger.warning(f"Job {job_id} was marked failed while it ran; leaving it failed")
+            finish_ingest_job(job_id, path)
+        
+        if finished and outcome['status'] == 'done' and os.path.isdir(snapshot_folder(job.user_id)):
+            refresh_snapshot_job(job.user_id)
+
+def finish_ingest_job(job_id, path):
+    """Stop stamping a job and remove its stored upload"""
+    with active_jobs_lock:
+        active_jobs.discard(job_id)
     try:
-        return float(clean_value)
-    except (ValueError, TypeError):
-        return 0.0
+        os.remove(path)
+    except OSError:
+        pass
 
-def extract_keywords(description):
-    """Extract meaningful keywords from transaction description"""
-    if not description:
-        return []
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = IngestJob.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status in ACTIVE_JOB_STATUSES and (job.heartbeat_at or job.created_at) < stale_job_cutoff():
+        expire_stale_jobs()
+        db.session.refresh(job)
+    return jsonify(job.to_dict())
+
+# Columns written by the ingestion pipeline, in COPY order
+INGEST_COLUMNS = [
+    'posted_date', 'posted_account', 'description1', 'description2', 'description3',
+    'debit_amount', 'credit_amount', 'balance', 'transaction_type', 'category',
+    'file_id', 'account_id', 'created_at', 'fingerprint'
+]
+
+def ingest_csv(stream, file_id, account_id, user_id, progress=None):
+    """Parse, categorise and insert an uploaded CSV in fixed-size batches.
     
-    # Remove special characters and convert to lowercase
-    clean_desc = re.sub(r'[^\w\s]', ' ', description.lower())
+    Rows flow through generators so only one batch is held in memory at a time.
+    progress(rows, inserted) is called after every batch; unless it commits,
+    nothing is committed until every batch has been written.
+    """
+    started = time.perf_counter()
+    queries_before = getattr(query_counter, 'count', 0)
+    timings = current_timings()
+    schema, rows, date_parser = open_csv(stream, timings)
+    transactions = timings.iterate(
+        'parse', assign_fingerprints(iter_transactions(rows, schema, file_id, account_id, date_parser))
+    )
+    category_index = get_category_index(user_id)
+    rules = get_category_rules(user_id)
     
-    # Split into words and remove common words and numbers
-    words = [word for word in clean_desc.split() if len(word) > 2 and not word.isdigit()]
+    count = 0
+    inserted = 0
+    for batch in chunked(transactions, app.config['INGEST_BATCH_SIZE']):
+        count += len(batch)
+        inserted += store_batch(batch, account_id, category_index, rules, timings)
+        if progress:
+            progress(count, inserted)
+    with timings.phase('commit'):
+        db.session.commit()
+    record_upload_metrics(count, timings)
     
-    return words
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': count,
+        'inserted': inserted,
+        'skipped': count - inserted,
+        'db_queries': getattr(query_counter, 'count', 0) - queries_before,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(count / elapsed) if elapsed > 0 else None,
+        'peak_rss_kb': peak_rss_kb(),
+        'phases': timings.as_dict()
+    }
 
-def suggest_category(description, user_id):
-    """Suggest a category based on transaction description and user's past categorizations"""
-    if not description:
-        return None
-    
-    keywords = extract_keywords(description)
-    if not keywords:
-        return None
+def record_upload_metrics(rows, timings):
+    metrics.inc('budget_upload_rows_total', {}, rows)
+    for name, seconds in timings.seconds.items():
+        metrics.inc('budget_upload_phase_seconds_total', {'phase': name}, seconds)
+
+def store_batch(batch, account_id, category_index, rules, timings):
+    """Skip known rows, then categorise, insert and roll up the rest; returns rows inserted"""
+    with timings.phase('dedupe'):
+        batch = drop_existing(batch)
+    if not batch:
+        return 0
     
-    # Check if any keywords match existing mappings
-    for keyword in keywords:
-        mapping = CategoryMapping.query.filter_by(
-            user_id=user_id, 
-            keyword=keyword
-        ).order_by(CategoryMapping.count.desc()).first()
-        
-        if mapping:
-            return mapping.category
+    with timings.phase('categorise'):
+        categorize_batch(batch, category_index, rules)
+    with timings.phase('insert'):
+        write_transaction_batch(batch)
+    with timings.phase('rollup'):
+        rollup_deltas = {}
+        add_rollup_deltas(rollup_deltas, batch)
+        apply_rollup_deltas(account_id, rollup_deltas)
+        bump_account_version(account_id)
+    return len(batch)
+
+def parse_csv_bytes(data, account_id):
+    """Parse a whole CSV into fingerprinted transaction dicts without touching the database.
     
-    return None
+    Runs in parse pool processes; file_id is filled in by the caller.
+    Returns the transactions and the seconds spent parsing.
+    """
+    started = time.perf_counter()
+    schema, rows, date_parser = open_csv(io.BytesIO(data), PhaseTimings())
+    transactions = list(assign_fingerprints(iter_transactions(rows, schema, None, account_id, date_parser)))
+    return transactions, time.perf_counter() - started
 
-@app.route('/transactions', methods=['GET'])
+def open_csv(stream, timings):
+    """Decode a binary upload incrementally.
+    
+    Returns the compiled header schema, an iterator over the remaining rows and
+    a date parser for the format inferred from the first rows. Reading and
+    decoding lines is timed as the 'decode' phase, detecting the dialect,
+    header and date format as 'sniff'.
+    """
+    csv_file = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    
+    with timings.phase('sniff'):
+        # Try to determine dialect
+        sample = csv_file.read(1024)
+        csv_file.seek(0)
+        dialect = csv.Sniffer().sniff(sample)
+        
+        # The first row always names the columns
+        reader = csv.reader(timings.iterate('decode', csv_file), dialect=dialect)
+        headers = next(reader, None) or []
+        schema = compile_header_schema(tuple(headers))
+        rows = (row for row in reader if row)
+        
+        # Sample the date column once and parse the whole file with that format
+        sample = list(islice(rows, DATE_SAMPLE_ROWS))
+        date_parser = make_date_parser(infer_date_format(schema.value(row, 'date') for row in sample))
+    return schema, chain(sample, rows), date_parser
+
+def iter_transactions(rows, schema, file_id, account_id, date_parser=parse_date):
+    """Turn CSV rows into transaction column dicts"""
+    for row in rows:
+        yield from process_row(row, schema, file_id, account_id, date_parser)
+
+def cents(amount):
+    return '' if amount is None else str(to_cents(amount))
+
+def assign_fingerprints(transactions):
+    """Add a content fingerprint to each transaction dict.
+    
+    The fingerprint covers the account, date, descriptions, amounts and balance.
+    Identical rows within one file (same-day repeats) get successive ordinals,
+    so they stay distinct while a re-upload of the same file matches exactly.
+    """
+    occurrences = Counter()
+    for transaction in transactions:
+        posted_date = transaction['posted_date']
+        content = '\x1f'.join([
+            str(transaction['account_id']),
+            posted_date.isoformat() if posted_date else '',
+            transaction['description1'] or '',
+            transaction['description2'] or '',
+            transaction['description3'] or '',
+            cents(transaction['debit_amount']),
+            cents(transaction['credit_amount']),
+            # A missing balance hashes like 0.00, as it was stored before,
+            # so files imported then still match on re-upload
+            cents(transaction['balance'] or 0)
+        ])
+        content_digest = hashlib.sha1(content.encode('utf-8')).digest()
+        ordinal = occurrences[content_digest]
+        occurrences[content_digest] += 1
+        transaction['fingerprint'] = hashlib.sha1(content_digest + str(ordinal).encode()).hexdigest()
+        yield transaction
+
+def drop_existing(batch):
+    """Remove transactions whose fingerprint is already stored, with one query per batch"""
+    existing = set(db.session.execute(
+        select(Transaction.fingerprint).where(
+            Transaction.fingerprint.in_([t['fingerprint'] for t in batch])
+        )
+    ).scalars())
+    if not existing:
+        return batch
+    return [t for t in batch if t['fingerprint'] not in existing]
+
+def categorize_batch(transactions, category_index, rules):
+    """Categorise a batch of transaction dicts; rules win over learned keywords"""
+    ruled = rules.classify(transactions)
+    learned, _ = category_index.classify([t['description1'] for t in transactions])
+    for transaction, rule_category, learned_category in zip(transactions, ruled, learned):
+        category = rule_category or learned_category
+        if category:
+            transaction['category'] = category
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def write_transaction_batch(batch):
+    """Insert a batch of transaction dicts with a single Core statement (COPY on PostgreSQL)"""
+    if db.engine.dialect.name == 'postgresql':
+        copy_transaction_batch(batch)
+    else:
+        db.session.execute(insert(Transaction.__table__), batch)
+
+def copy_transaction_batch(batch):
+    """Stream a batch into PostgreSQL with COPY FROM STDIN"""
+    now = datetime.utcnow()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for transaction in batch:
+        values = []
+        for column in INGEST_COLUMNS:
+            value = transaction.get(column)
+            if column == 'created_at' and value is None:
+                value = now
+            values.append(r'\N' if value is None else value)
+        writer.writerow(values)
+    buffer.seek(0)
+    
+    table = db.engine.dialect.identifier_preparer.format_table(Transaction.__table__)
+    columns = ', '.join(INGEST_COLUMNS)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def peak_rss_kb():
+    """Peak resident set size of this process in kilobytes, if the platform reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Candidate column names for each transaction field, in priority order
+FIELD_CANDIDATES = {
+    'date': ['date', 'posted_date', 'transaction_date', 'posting_date'],
+    'account': ['account', 'posted_account', 'account_number'],
+    'description': ['description', 'transaction_description', 'details', 'narrative'],
+    'debit': ['debit', 'debit_amount', 'withdrawal', 'amount_out'],
+    'credit': ['credit', 'credit_amount', 'deposit', 'amount_in'],
+    'balance': ['balance', 'running_balance', 'current_balance'],
+    'amount': ['amount', 'value', 'transaction_amount']
+}
+
+# Columns copied verbatim by their exact header name
+RAW_FIELDS = {
+    'description2': 'Description2',
+    'description3': 'Description3',
+    'transaction_type': 'Transaction Type'
+}
+
+class HeaderSchema:
+    """Column positions for every transaction field, resolved once per header layout"""
+    
+    def __init__(self, headers):
+        self.headers = headers
+        
+        # Attempt to normalize column names
+        normalized = [
+            header.lower().strip().replace(' ', '_') if header else None
+            for header in headers
+        ]
+        
+        # Each field keeps every matching column so a row can fall through
+        # to the next candidate when the preferred one is empty
+        self.columns = {}
+        for field, keys in FIELD_CANDIDATES.items():
+            positions = []
+            for key in keys:
+                for index, column in enumerate(normalized):
+                    if column and key in column and index not in positions:
+                        positions.append(index)
+            self.columns[field] = tuple(positions)
+        
+        self.raw_columns = {
+            field: headers.index(name) if name in headers else None
+            for field, name in RAW_FIELDS.items()
+        }
+    
+    def value(self, row, field):
+        """Find the first non-empty value for a field"""
+        for index in self.columns[field]:
+            if index < len(row):
+                value = row[index]
+                if value and value.strip():
+                    return value
+        return None
+    
+    def raw_value(self, row, field):
+        index = self.raw_columns[field]
+        if index is None:
+            return ''
+        return row[index] if index < len(row) else None
+
+@lru_cache(maxsize=64)
+def compile_header_schema(headers):
+    """Compile a header tuple into a HeaderSchema, cached per bank export layout"""
+    app.logger.info(f"CSV columns: {list(headers)}")
+    return HeaderSchema(headers)
+
+def process_row(row, schema, file_id, account_id, date_parser=parse_date):
+    """Process a CSV row and return one or more transaction column dicts"""
+    transactions = []
+    
+    try:
+        # Extract values using the compiled column positions
+        date_str = schema.value(row, 'date')
+        account_name = schema.value(row, 'account')
+        description = schema.value(row, 'description')
+        
+        debit_str = schema.value(row, 'debit')
+        credit_str = schema.value(row, 'credit')
+        balance_str = schema.value(row, 'balance')
+        
+        # Parse numerical values
+        debit_amount = parse_amount(debit_str)
+        credit_amount = parse_amount(credit_str)
+        # Card exports have no balance column; store NULL rather than 0.00
+        balance = parse_amount(balance_str) if balance_str is not None else None
+        
+        # Handle case where there's a single amount column with positive/negative values
+        amount_str = schema.value(row, 'amount')
+        if amount_str and not (debit_str or credit_str):
+            amount = parse_amount(amount_str)
+            if amount < 0:
+                debit_amount = -amount
+            else:
+                credit_amount = amount
+        
+        # Create the transaction
+        transaction = {
+            'posted_date': date_parser(date_str),
+            'posted_account': account_name,
+            'description1': description,
+            'description2': schema.raw_value(row, 'description2'),
+            'description3': schema.raw_value(row, 'description3'),
+            'debit_amount': debit_amount,
+            'credit_amount': credit_amount,
+            'balance': balance,
+            'transaction_type': schema.raw_value(row, 'transaction_type'),
+            'category': 'Uncategorized',
+            'file_id': file_id,
+            'account_id': int(account_id)
+        }
+        transactions.append(transaction)
+        
+    except DateFormatError:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error processing row: {str(e)}")
+        app.logger.error(f"Row data: {row}")
+    
+    return transactions
+
+# Characters dropped from amounts before parsing
+AMOUNT_NOISE = str.maketrans('', '', '$£€, ')
+
+def parse_cents(value_str):
+    """Parse a money string such as '2,018.79', '(12.50)' or '€5' into integer cents.
+    
+    Blank or unreadable values give 0. Digits past the cents round half up.
+    """
+    if not value_str or not isinstance(value_str, str):
+        return 0
+    
+    clean_value = value_str.translate(AMOUNT_NOISE)
+    negative = False
+    if clean_value.startswith('(') and clean_value.endswith(')'):
+        negative = True
+        clean_value = clean_value[1:-1]
+    if clean_value.startswith('-'):
+        negative = not negative
+        clean_value = clean_value[1:]
+    elif clean_value.startswith('+'):
+        clean_value = clean_value[1:]
+    
+    whole, _, fraction = clean_value.partition('.')
+    if not (whole or fraction):
+        return 0
+    try:
+        cents = int(whole or '0') * 100 + int((fraction + '00')[:2])
+        if len(fraction) > 2:
+            int(fraction)  # reject anything but digits
+            if fraction[2] >= '5':
+                cents += 1
+    except ValueError:
+        return 0
+    
+    return -cents if negative else cents
+
+def parse_amount(value_str):
+    """Parse a money string into an exact two-place Decimal"""
+    return Decimal(parse_cents(value_str)).scaleb(-2)
+
+def to_cents(amount):
+    """Whole cents of a Decimal or float amount"""
+    if amount is None:
+        return 0
+    return int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP))
+
+def money(amount):
+    """A stored amount as a JSON number"""
+    return None if amount is None else float(amount)
+
+# Runs of word characters; everything else separates keywords
+WORD_PATTERN = re.compile(r'\w+')
+
+def extract_keywords(description):
+    """Extract meaningful keywords from transaction description"""
+    if not description:
+        return []
+    
+    # Split on special characters and whitespace, in lowercase
+    words = WORD_PATTERN.findall(description.lower())
+    
+    # Remove short words and numbers
+    return [word for word in words if len(word) > 2 and not word.isdigit()]
+
+DIGITS_PATTERN = re.compile(r'\d+')
+
+@lru_cache(maxsize=100000)
+def merchant_key(description):
+    """Normalised merchant name for grouping a description with its repeats.
+    
+    The description's keywords with digits removed, so references and dates
+    inside them ('REVCOM0529123', 'Revolut**4821*') do not split a merchant.
+    Descriptions with no keywords ('LN 9310124046') keep their words, with
+    each run of digits replaced by '#'.
+    """
+    words = []
+    for keyword in extract_keywords(description):
+        word = DIGITS_PATTERN.sub('', keyword)
+        if len(word) > 2 and word not in words:
+            words.append(word)
+    if words:
+        return ' '.join(words)
+    return ' '.join(DIGITS_PATTERN.sub('#', (description or '').lower()).split())
+
+class CategoryIndex:
+    """Keyword x category weight matrix built from a user's category mappings.
+    
+    Each mapping adds its use count, halved every CATEGORY_HALF_LIFE_DAYS since
+    it was last used, to its keyword's row. A description scores every category
+    at once by summing the rows of the keywords it contains.
+    """
+    
+    def __init__(self, mappings, now=None):
+        now = now or datetime.utcnow()
+        half_life = app.config['CATEGORY_HALF_LIFE_DAYS']
+        
+        self.categories = list(CATEGORIES)
+        category_ids = {category: i for i, category in enumerate(self.categories)}
+        self.keyword_ids = {}
+        
+        entries = []
+        for keyword, category, count, last_used in mappings:
+            if category not in category_ids:
+                category_ids[category] = len(self.categories)
+                self.categories.append(category)
+            keyword_id = self.keyword_ids.setdefault(keyword, len(self.keyword_ids))
+            age_days = max((now - last_used).total_seconds() / 86400, 0) if last_used else 0
+            weight = (count or 1) * 0.5 ** (age_days / half_life)
+            entries.append((keyword_id, category_ids[category], weight))
+        
+        self.weights = np.zeros((len(self.keyword_ids), len(self.categories)))
+        for keyword_id, category_id, weight in entries:
+            self.weights[keyword_id, category_id] += weight
+    
+    def keyword_hits(self, description):
+        """Ids of the mapped keywords that appear in a description"""
+        if not description:
+            return []
+        # Mapped keywords all came from extract_keywords, so the raw word split
+        # is enough; short words and numbers simply never match
+        keyword_ids = self.keyword_ids
+        words = set(WORD_PATTERN.findall(description.lower()))
+        return [keyword_ids[word] for word in words if word in keyword_ids]
+    
+    def classify(self, descriptions):
+        """Score a batch of descriptions against every category.
+        
+        Returns parallel lists of the best category (None when no keyword is
+        mapped) and its share of the total score as a confidence.
+        """
+        # Tokenise each distinct description once; bank exports repeat a lot
+        unique_ids = {}
+        unique_hits = []
+        inverse = np.empty(len(descriptions), dtype=np.int64)
+        for i, description in enumerate(descriptions):
+            unique_id = unique_ids.get(description)
+            if unique_id is None:
+                unique_id = unique_ids[description] = len(unique_hits)
+                unique_hits.append(self.keyword_hits(description))
+            inverse[i] = unique_id
+        
+        # Sparse description x keyword matrix in CSR form, multiplied by the
+        # dense keyword x category weights with a segmented sum
+        lengths = np.fromiter(map(len, unique_hits), dtype=np.int64, count=len(unique_hits))
+        hits = np.fromiter(chain.from_iterable(unique_hits), dtype=np.int64, count=int(lengths.sum()))
+        scores = np.zeros((len(unique_hits), len(self.categories)))
+        matched = lengths > 0
+        if hits.size:
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            scores[matched] = np.add.reduceat(self.weights[hits], starts[matched], axis=0)
+        
+        best = scores.argmax(axis=1)
+        totals = scores.sum(axis=1)
+        top = scores[np.arange(len(unique_hits)), best]
+        confidence = np.divide(top, totals, out=np.zeros_like(top), where=totals > 0)
+        
+        names = np.array(self.categories + [None], dtype=object)
+        best = np.where(matched & (totals > 0), best, len(self.categories))
+        return names[best][inverse].tolist(), confidence[inverse].round(4).tolist()
+    
+    def suggest(self, description):
+        """Return the best category for a single description"""
+        if not description:
+            return None
+        categories, _ = self.classify([description])
+        return categories[0]
+
+# Loaded category indexes per user: user_id -> (loaded_at, CategoryIndex).
+# Writes in this process invalidate immediately; the TTL bounds how stale
+# another gunicorn worker's copy can get.
+category_indexes = {}
+
+def get_category_index(user_id):
+    """Return the user's category index, loading all mappings in one query if needed"""
+    entry = category_indexes.get(user_id)
+    if entry and time.monotonic() - entry[0] < app.config['CATEGORY_INDEX_TTL']:
+        return entry[1]
+    
+    mappings = db.session.query(
+        CategoryMapping.keyword,
+        CategoryMapping.category,
+        CategoryMapping.count,
+        CategoryMapping.last_used
+    ).filter_by(user_id=user_id).all()
+    
+    index = CategoryIndex(mappings)
+    category_indexes[user_id] = (time.monotonic(), index)
+    return index
+
+def invalidate_category_index(user_id):
+    category_indexes.pop(user_id, None)
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over many literal patterns.
+    
+    One left-to-right pass over a text reports every occurrence of every
+    pattern, however many patterns there are.
+    """
+    
+    def __init__(self, patterns):
+        """Build from (text, value) pairs; texts are matched exactly as given"""
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        for text, value in patterns:
+            state = 0
+            for char in text:
+                next_state = self.transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][char] = next_state
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                state = next_state
+            self.outputs[state] += ((len(text), value),)
+        
+        # Breadth first, so a state's failure link is final before its children's
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.transitions[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+    
+    def search(self, text):
+        """Yield (start, value) for every pattern occurrence in text"""
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            for length, value in outputs[state]:
+                yield end - length + 1, value
+
+# A backreference or conditional naming a group by number
+NUMBERED_GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?\(\d')
+
+class CategoryRules:
+    """A user's categorisation rules compiled into one matcher.
+    
+    Prefix and substring patterns share one case-insensitive Aho-Corasick
+    automaton, and the regexes are merged into one alternation that screens
+    out descriptions none of them can match. Rules are tried by descending
+    priority, oldest first, and the first whose conditions all hold wins.
+    """
+    
+    # Distinct descriptions whose text matches are remembered between batches
+    MEMO_SIZE = 100000
+    
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda rule: (-rule.priority, rule.id))
+        self.unconditional = []
+        literals = []
+        self.regexes = []
+        for index, rule in enumerate(self.rules):
+            if rule.match_type in ('prefix', 'contains'):
+                literals.append((rule.pattern.lower(), index))
+            elif rule.match_type == 'regex':
+                self.regexes.append((index, re.compile(rule.pattern, re.IGNORECASE)))
+            else:
+                self.unconditional.append(index)
+        self.automaton = KeywordAutomaton(literals) if literals else None
+        # Text-only rules need no per-transaction checks once their text matches
+        self.filtered = [
+            any(value is not None for value in (
+                rule.account_id, rule.transaction_type, rule.min_amount, rule.max_amount
+            ))
+            for rule in self.rules
+        ]
+        
+        self.regex_screen = None
+        # Joining patterns renumbers their groups, so one that refers to a group
+        # by number (\1, (?(1)...)) would point at another pattern's group
+        if self.regexes and not any(NUMBERED_GROUP_REFERENCE.search(regex.pattern) for _, regex in self.regexes):
+            try:
+                self.regex_screen = re.compile(
+                    '|'.join(f'(?:{regex.pattern})' for _, regex in self.regexes), re.IGNORECASE
+                )
+            except re.error:
+                # Some patterns only compile on their own (repeated group names,
+                # inline flags); those rule sets test every regex instead
+                pass
+        self.memo = {}
+    
+    def text_matches(self, description):
+        """Indexes of the rules whose description condition holds, in rule order"""
+        matches = self.memo.get(description)
+        if matches is not None:
+            return matches
+        
+        text = description or ''
+        matched = set(self.unconditional)
+        if self.automaton:
+            for start, index in self.automaton.search(text.lower()):
+                if start == 0 or self.rules[index].match_type == 'contains':
+                    matched.add(index)
+        if self.regexes and (self.regex_screen is None or self.regex_screen.search(text)):
+            matched.update(index for index, regex in self.regexes if regex.search(text))
+        
+        matches = sorted(matched)
+        if len(self.memo) >= self.MEMO_SIZE:
+            self.memo.clear()
+        self.memo[description] = matches
+        return matches
+    
+    @staticmethod
+    def conditions_hold(rule, transaction):
+        """Check a rule's account, type and amount conditions against a transaction"""
+        if rule.account_id is not None and rule.account_id != transaction['account_id']:
+            return False
+        debit = transaction['debit_amount'] or 0
+        credit = transaction['credit_amount'] or 0
+        if rule.transaction_type == 'debit' and not debit > 0:
+            return False
+        if rule.transaction_type == 'credit' and not credit > 0:
+            return False
+        amount = debit if debit > 0 else credit
+        if rule.min_amount is not None and amount < rule.min_amount:
+            return False
+        if rule.max_amount is not None and amount > rule.max_amount:
+            return False
+        return True
+    
+    def classify(self, transactions):
+        """Category of the first matching rule for each transaction dict, or None"""
+        if not self.rules:
+            return [None] * len(transactions)
+        
+        categories = []
+        for transaction in transactions:
+            category = None
+            for index in self.text_matches(transaction['description1']):
+                rule = self.rules[index]
+                if not self.filtered[index] or self.conditions_hold(rule, transaction):
+                    category = rule.category
+                    break
+            categories.append(category)
+        return categories
+
+# Compiled rules per user: user_id -> (loaded_at, CategoryRules), kept the
+# same way as category_indexes
+category_rules = {}
+
+def get_category_rules(user_id):
+    """Return the user's compiled categorisation rules, loading them in one query if needed"""
+    entry = category_rules.get(user_id)
+    if entry and time.monotonic() - entry[0] < app.config['CATEGORY_INDEX_TTL']:
+        return entry[1]
+    
+    table = CategoryRule.__table__
+    rows = db.session.execute(select(table).where(table.c.user_id == user_id)).all()
+    rules = CategoryRules(rows)
+    category_rules[user_id] = (time.monotonic(), rules)
+    return rules
+
+def invalidate_category_rules(user_id):
+    category_rules.pop(user_id, None)
+
+def suggest_category(description, user_id):
+    """Suggest a category based on transaction description and user's past categorizations"""
+    return get_category_index(user_id).suggest(description)
+
+# Largest page the transaction listing will return
+MAX_PAGE_SIZE = 5000
+
+def encode_cursor(transaction):
+    """Opaque token for the (posted_date, id) position after a transaction"""
+    posted_date = transaction.posted_date.isoformat() if transaction.posted_date else None
+    raw = json.dumps([posted_date, transaction.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError for malformed tokens"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        posted_date, transaction_id = json.loads(raw)
+        posted_date = datetime.strptime(posted_date, '%Y-%m-%d').date() if posted_date else None
+        return posted_date, int(transaction_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def after_cursor(posted_date, transaction_id):
+    """Rows that sort after the cursor in (posted_date desc nulls last, id desc) order"""
+    if posted_date is None:
+        return and_(Transaction.posted_date.is_(None), Transaction.id < transaction_id)
+    return or_(
+        Transaction.posted_date < posted_date,
+        and_(Transaction.posted_date == posted_date, Transaction.id < transaction_id),
+        Transaction.posted_date.is_(None)
+    )
+
+def transaction_amount():
+    """The positive amount of a transaction, whichever side it is on"""
+    return case(
+        (Transaction.debit_amount > 0, Transaction.debit_amount),
+        else_=func.coalesce(Transaction.credit_amount, 0)
+    )
+
+def transaction_filters(args):
+    """Build WHERE clauses from listing query parameters; raises ValueError on bad input"""
+    filters = []
+    
+    for name, compare in (('start_date', Transaction.posted_date.__ge__),
+                          ('end_date', Transaction.posted_date.__le__)):
+        if args.get(name):
+            try:
+                filters.append(compare(datetime.strptime(args[name], '%Y-%m-%d').date()))
+            except ValueError:
+                raise ValueError(f'Invalid {name}, expected YYYY-MM-DD')
+    
+    if args.get('category'):
+        filters.append(Transaction.category == args['category'])
+    
+    for name, compare in (('min_amount', transaction_amount().__ge__),
+                          ('max_amount', transaction_amount().__le__)):
+        if args.get(name):
+            try:
+                filters.append(compare(Decimal(args[name])))
+            except ArithmeticError:
+                raise ValueError(f'Invalid {name}')
+    
+    if args.get('q'):
+        # Matches the trigram-indexed expression, so PostgreSQL need not scan
+        filters.append(search_text().like(like_pattern(args['q'].lower()), escape='/'))
+    
+    return filters
+
+@app.route('/transactions', methods=['GET'])
 @login_required
+@cached_response
 def get_transactions():
+    """List an account's transactions newest first, one keyset page at a time.
+    
+    The body is a JSON list; when more rows exist the token for the next page is
+    returned in the X-Next-Cursor header (and as a Link rel="next").
+    """
     account_id = request.args.get('account_id')
     if not account_id:
         return jsonify({'error': 'Account ID is required'}), 400
@@ -424,8 +2106,388 @@ def get_transactions():
     if not account:
         return jsonify({'error': 'Invalid account ID'}), 400
     
-    transactions = Transaction.query.filter_by(account_id=account_id).order_by(Transaction.posted_date.desc()).limit(100).all()
-    return jsonify([t.to_dict() for t in transactions])
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    
+    try:
+        filters = transaction_filters(request.args)
+        if request.args.get('cursor'):
+            filters.append(after_cursor(*decode_cursor(request.args['cursor'])))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    
+    transactions = Transaction.query.filter_by(account_id=account_id).filter(*filters).order_by(
+        Transaction.posted_date.desc().nulls_last(),
+        Transaction.id.desc()
+    ).limit(limit + 1).all()
+    
+    response = jsonify([t.to_dict() for t in transactions[:limit]])
+    if len(transactions) > limit:
+        next_cursor = encode_cursor(transactions[limit - 1])
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("get_transactions", **args)}>; rel="next"'
+    return response
+
+# Description search. PostgreSQL answers from a trigram index on
+# SEARCH_TEXT_SQL (see migrate.py); other databases use an in-process
+# inverted index per user.
+
+MAX_SEARCH_RESULTS = 500
+
+def like_pattern(text):
+    """A LIKE pattern matching text anywhere, with wildcards in it escaped"""
+    escaped = text.replace('/', '//').replace('%', '/%').replace('_', '/_')
+    return f'%{escaped}%'
+
+def search_text():
+    """The indexed search text: all three descriptions, lowercased"""
+    return literal_column(SEARCH_TEXT_SQL)
+
+def compact(text):
+    """Lowercase letters and digits only, so 'Grafton Barbers' matches 'GraftonBarbers'"""
+    return ''.join(WORD_PATTERN.findall(text.lower())).replace('_', '')
+
+def padded_trigrams(token):
+    """Trigrams of a token padded like pg_trgm, which favours matching word starts"""
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """In-process inverted index over one user's transaction descriptions.
+    
+    Each distinct (account, description) text is a document, indexed once by
+    its extract_keywords tokens however many transactions share it. The
+    vocabulary is kept sorted for prefix lookups and indexed by trigram for
+    substring and typo-tolerant matches. Transactions are only ever added, so
+    the index catches up by loading ids above the highest one it has seen.
+    """
+    
+    # Least trigram similarity for a vocabulary token to count as a typo of a query token
+    FUZZY_THRESHOLD = 0.4
+    
+    def __init__(self):
+        self.max_id = 0
+        self.documents = {}
+        self.document_keys = []
+        self.document_texts = []
+        self.transaction_ids = []
+        self.transaction_days = []
+        self.latest_day = []
+        self.newest_first = {}
+        self.token_ids = {}
+        self.tokens = []
+        self.postings = []
+        self.trigrams = defaultdict(set)
+        self.vocabulary = None
+    
+    def token_id(self, token):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.postings.append(set())
+            for trigram in padded_trigrams(token):
+                self.trigrams[trigram].add(token_id)
+            self.vocabulary = None
+        return token_id
+    
+    def add(self, rows):
+        """Index (id, account_id, posted_date, description1, description2, description3) rows in id order"""
+        documents = self.documents
+        transaction_ids = self.transaction_ids
+        transaction_days = self.transaction_days
+        latest_day = self.latest_day
+        for transaction_id, account_id, posted_date, *descriptions in rows:
+            key = (account_id, *descriptions)
+            document = documents.get(key)
+            if document is None:
+                text = ' '.join(d for d in descriptions if d)
+                document = documents[key] = len(self.document_keys)
+                self.document_keys.append(key)
+                self.document_texts.append(compact(text))
+                transaction_ids.append(array('q'))
+                transaction_days.append(array('i'))
+                latest_day.append(0)
+                for token in set(extract_keywords(text)):
+                    self.postings[self.token_id(token)].add(document)
+            day = posted_date.toordinal() if posted_date else 0
+            transaction_ids[document].append(transaction_id)
+            transaction_days[document].append(day)
+            if day > latest_day[document]:
+                latest_day[document] = day
+            self.newest_first.pop(document, None)
+            self.max_id = transaction_id
+    
+    def newest_transactions(self, document):
+        """A document's transaction ids, newest first; sorted once until it grows"""
+        ids = self.newest_first.get(document)
+        if ids is None:
+            dated = sorted(zip(self.transaction_days[document], self.transaction_ids[document]), reverse=True)
+            ids = self.newest_first[document] = array('q', (transaction_id for _, transaction_id in dated))
+        return ids
+    
+    def match_token(self, query_token):
+        """Vocabulary token ids matching a query token, with a match quality in (0, 1]"""
+        matches = {}
+        exact = self.token_ids.get(query_token)
+        if exact is not None:
+            matches[exact] = 1.0
+        
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.tokens)
+        i = bisect_left(self.vocabulary, query_token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(query_token):
+            matches.setdefault(self.token_ids[self.vocabulary[i]], 0.9)
+            i += 1
+        
+        query_trigrams = padded_trigrams(query_token)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.trigrams.get(trigram, ()))
+        for token_id, count in shared.items():
+            if token_id in matches:
+                continue
+            token = self.tokens[token_id]
+            if query_token in token or (len(token) > 3 and token in query_token):
+                matches[token_id] = 0.8
+                continue
+            similarity = count / (len(query_trigrams) + len(padded_trigrams(token)) - count)
+            if similarity >= self.FUZZY_THRESHOLD:
+                matches[token_id] = min(similarity, 0.7)
+        return matches
+    
+    def search(self, query, account_id=None, limit=50):
+        """Return [(transaction id, score)] best first, newest first within a description"""
+        query_tokens = list(dict.fromkeys(extract_keywords(query)))
+        compact_query = compact(query)
+        
+        # Every query token has to match some token of a document
+        scores = {}
+        for position, query_token in enumerate(query_tokens):
+            best = {}
+            for token_id, quality in self.match_token(query_token).items():
+                for document in self.postings[token_id]:
+                    if quality > best.get(document, 0):
+                        best[document] = quality
+            if position == 0:
+                scores = best
+            else:
+                scores = {document: score + best[document] for document, score in scores.items() if document in best}
+        scores = {document: score / len(query_tokens) for document, score in scores.items()}
+        
+        # Text the tokens miss (numbers, short words, joined words) still matches as a substring
+        if compact_query:
+            candidates = list(scores) if scores else range(len(self.document_texts))
+            for document in candidates:
+                if compact_query in self.document_texts[document]:
+                    scores[document] = scores.get(document, 0) + 1.0
+        
+        if account_id is not None:
+            scores = {d: s for d, s in scores.items() if self.document_keys[d][0] == account_id}
+        
+        results = []
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], self.latest_day[item[0]]))
+        for document, score in ranked:
+            for transaction_id in self.newest_transactions(document)[:limit - len(results)]:
+                results.append((transaction_id, min(score, 2.0) / 2))
+            if len(results) >= limit:
+                break
+        return results
+
+search_indexes = {}
+search_index_lock = threading.Lock()
+
+def indexed_search(user_id, query, account_id, limit):
+    """Search the user's in-process index after loading any transactions it has not seen"""
+    with search_index_lock:
+        index = search_indexes.setdefault(user_id, SearchIndex())
+        table = Transaction.__table__
+        rows = db.session.execute(
+            select(
+                table.c.id, table.c.account_id, table.c.posted_date,
+                table.c.description1, table.c.description2, table.c.description3
+            )
+            .join(Account.__table__, table.c.account_id == Account.__table__.c.id)
+            .where(Account.__table__.c.user_id == user_id, table.c.id > index.max_id)
+            .order_by(table.c.id)
+            .execution_options(yield_per=10000)
+        )
+        for batch in rows.partitions():
+            index.add(batch)
+        return index.search(query, account_id, limit)
+
+def postgresql_search(user_id, query, account_id, limit):
+    """Substring and trigram-similarity matches from the pg_trgm index, best first"""
+    text = search_text()
+    lowered = bindparam('query', query.lower())
+    pattern = bindparam('pattern', like_pattern(query.lower()))
+    substring = text.like(pattern, escape='/')
+    score = func.greatest(
+        func.word_similarity(lowered, text),
+        func.similarity(text, lowered),
+        case((substring, 1.0), else_=0.0)
+    )
+    statement = (
+        select(Transaction.id, score)
+        .join(Account, Transaction.account_id == Account.id)
+        .where(Account.user_id == user_id, or_(substring, text.op('%>')(lowered)))
+        .order_by(score.desc(), Transaction.posted_date.desc().nulls_last(), Transaction.id.desc())
+        .limit(limit)
+    )
+    if account_id is not None:
+        statement = statement.where(Transaction.account_id == account_id)
+    return [(transaction_id, float(score)) for transaction_id, score in db.session.execute(statement)]
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_transactions():
+    """Ranked search over descriptions with substring, prefix and typo-tolerant matches.
+    
+    Returns a JSON list of transactions, each with a score between 0 and 1.
+    """
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    if limit < 1 or limit > MAX_SEARCH_RESULTS:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SEARCH_RESULTS}'}), 400
+    
+    account_id = request.args.get('account_id')
+    if account_id:
+        account = Account.query.filter_by(id=account_id, user_id=session['user_id']).first()
+        if not account:
+            return jsonify({'error': 'Invalid account ID'}), 400
+        account_id = account.id
+    else:
+        account_id = None
+    
+    if db.engine.dialect.name == 'postgresql':
+        matches = postgresql_search(session['user_id'], query, account_id, limit)
+    else:
+        matches = indexed_search(session['user_id'], query, account_id, limit)
+    
+    transactions = {t.id: t for t in Transaction.query.filter(Transaction.id.in_([i for i, _ in matches]))}
+    return jsonify([
+        dict(transactions[transaction_id].to_dict(), score=round(score, 3))
+        for transaction_id, score in matches
+    ])
+
+# Columns in transaction exports, in CSV order
+EXPORT_COLUMNS = [
+    'id', 'account', 'posted_date', 'posted_account', 'description1', 'description2',
+    'description3', 'debit_amount', 'credit_amount', 'balance', 'transaction_type', 'category'
+]
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_ROWS = 1000
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def export_transactions():
+    """Stream transactions as CSV or newline-delimited JSON.
+    
+    Exports one account, or every account of the user when account_id is
+    omitted, and accepts the same filters as /transactions. Rows are read
+    through a server-side cursor and written as they arrive, so memory use
+    does not grow with the export. gzip=1 compresses the stream on the fly.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    user_id = session['user_id']
+    account_id = request.args.get('account_id')
+    if account_id:
+        account = Account.query.filter_by(id=account_id, user_id=user_id).first()
+        if not account:
+            return jsonify({'error': 'Invalid account ID'}), 400
+    
+    try:
+        filters = transaction_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if account_id:
+        filters.append(Transaction.account_id == account_id)
+    
+    query = select(
+        Transaction.id,
+        Account.name.label('account'),
+        Transaction.posted_date,
+        Transaction.posted_account,
+        Transaction.description1,
+        Transaction.description2,
+        Transaction.description3,
+        Transaction.debit_amount,
+        Transaction.credit_amount,
+        Transaction.balance,
+        Transaction.transaction_type,
+        Transaction.category
+    ).join(Account, Account.id == Transaction.account_id).where(
+        Account.user_id == user_id, *filters
+    ).order_by(Transaction.posted_date, Transaction.id)
+    
+    chunks = export_chunks(query, export_format)
+    filename = f"transactions.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def export_chunks(query, export_format):
+    """Yield the export as text, one chunk per cursor fetch"""
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    if export_format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    
+    for rows in result.partitions():
+        for row in rows:
+            if export_format == 'csv':
+                writer.writerow(row)
+            else:
+                record = row._asdict()
+                if record['posted_date']:
+                    record['posted_date'] = record['posted_date'].isoformat()
+                for column in ('debit_amount', 'credit_amount', 'balance'):
+                    record[column] = money(record[column])
+                buffer.write(json.dumps(record))
+                buffer.write('\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into a gzip byte stream"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 @app.route('/transaction/<int:transaction_id>/category', methods=['PUT'])
 @login_required
@@ -443,53 +2505,521 @@ def update_transaction_category(transaction_id):
     if not category or category not in CATEGORIES:
         return jsonify({'error': 'Invalid category'}), 400
     
-    # Update transaction category
+    # Update transaction category, moving its amounts between rollup rows
+    previous_category = transaction.category or 'Uncategorized'
     transaction.category = category
+    if previous_category != category:
+        rollup_deltas = {}
+        add_rollup_deltas(rollup_deltas, [{
+            'posted_date': transaction.posted_date,
+            'category': previous_category,
+            'debit_amount': transaction.debit_amount,
+            'credit_amount': transaction.credit_amount
+        }], sign=-1)
+        add_rollup_deltas(rollup_deltas, [{
+            'posted_date': transaction.posted_date,
+            'category': category,
+            'debit_amount': transaction.debit_amount,
+            'credit_amount': transaction.credit_amount
+        }])
+        apply_rollup_deltas(transaction.account_id, rollup_deltas)
+        bump_account_version(transaction.account_id)
     
     # Update category mapping for future suggestions
     if transaction.description1:
-        keywords = extract_keywords(transaction.description1)
-        for keyword in keywords:
-            # Check if mapping exists
-            mapping = CategoryMapping.query.filter_by(
-                user_id=session['user_id'],
-                keyword=keyword
-            ).first()
-            
-            if mapping:
-                # Update existing mapping
-                if mapping.category == category:
-                    mapping.count += 1
-                    mapping.last_used = datetime.utcnow()
-                else:
-                    # If different category has higher count, create new mapping
-                    new_mapping = CategoryMapping(
-                        user_id=session['user_id'],
-                        keyword=keyword,
-                        category=category
-                    )
-                    db.session.add(new_mapping)
-            else:
-                # Create new mapping
-                new_mapping = CategoryMapping(
-                    user_id=session['user_id'],
-                    keyword=keyword,
-                    category=category
-                )
-                db.session.add(new_mapping)
+        upsert_category_mappings(session['user_id'], [(transaction.description1, category)])
     
     db.session.commit()
+    invalidate_category_index(session['user_id'])
     
     return jsonify({'success': True, 'transaction': transaction.to_dict()})
 
+@app.route('/transactions/categories', methods=['PUT'])
+@login_required
+def update_transaction_categories():
+    """Set the category of many transactions at once.
+    
+    Body: {"updates": [{"transaction_id": 1, "category": "Food"}, ...]}.
+    Ownership is checked with one query, the categories are written with one
+    UPDATE and the keyword mappings with one upsert.
+    """
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'error': 'updates must be a non-empty list'}), 400
+    if len(updates) > MAX_PAGE_SIZE:
+        return jsonify({'error': f'At most {MAX_PAGE_SIZE} updates per request'}), 400
+    
+    categories = {}
+    for item in updates:
+        try:
+            transaction_id = int(item['transaction_id'])
+            category = item['category']
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Each update needs a transaction_id and a category'}), 400
+        if category not in CATEGORIES:
+            return jsonify({'error': f'Invalid category: {category}'}), 400
+        categories[transaction_id] = category
+    
+    rows = db.session.execute(
+        select(
+            Transaction.id, Transaction.account_id, Transaction.posted_date,
+            Transaction.description1, Transaction.category,
+            Transaction.debit_amount, Transaction.credit_amount
+        )
+        .join(Account, Transaction.account_id == Account.id)
+        .where(Transaction.id.in_(categories), Account.user_id == session['user_id'])
+    ).all()
+    if len(rows) != len(categories):
+        missing = sorted(set(categories) - {row.id for row in rows})
+        return jsonify({'error': 'Transactions not found or not accessible', 'transaction_ids': missing}), 403
+    
+    changed = [row for row in rows if (row.category or 'Uncategorized') != categories[row.id]]
+    if changed:
+        table = Transaction.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.id.in_([row.id for row in changed]))
+            .values(category=case({row.id: categories[row.id] for row in changed}, value=table.c.id))
+        )
+        
+        # Move the changed amounts between rollup rows, account by account
+        deltas_by_account = {}
+        for row in changed:
+            deltas = deltas_by_account.setdefault(row.account_id, {})
+            previous = dict(row._asdict(), category=row.category or 'Uncategorized')
+            add_rollup_deltas(deltas, [previous], sign=-1)
+            add_rollup_deltas(deltas, [dict(previous, category=categories[row.id])])
+        for account_id, deltas in deltas_by_account.items():
+            apply_rollup_deltas(account_id, deltas)
+            bump_account_version(account_id)
+    
+    upsert_category_mappings(
+        session['user_id'],
+        [(row.description1, categories[row.id]) for row in rows if row.description1]
+    )
+    
+    db.session.commit()
+    invalidate_category_index(session['user_id'])
+    
+    return jsonify({'success': True, 'updated': len(changed), 'unchanged': len(rows) - len(changed)})
+
+def upsert_category_mappings(user_id, examples):
+    """Learn keyword -> category mappings from (description, category) pairs.
+    
+    Each keyword votes once per description. A keyword that keeps its
+    category gains the votes, one whose category changes starts over with the
+    new category. All mappings are written with a single INSERT ... ON
+    CONFLICT, so every keyword may only appear once in it.
+    """
+    votes = Counter()
+    for description, category in examples:
+        for keyword in set(extract_keywords(description)):
+            votes[(keyword, category)] += 1
+    
+    # When one request files a keyword under several categories, the most used wins
+    winners = {}
+    for (keyword, category), count in votes.items():
+        if keyword not in winners or count > winners[keyword][1]:
+            winners[keyword] = (category, count)
+    if not winners:
+        return
+    
+    now = datetime.utcnow()
+    table = CategoryMapping.__table__
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'keyword'],
+        set_={
+            'category': statement.excluded.category,
+            'count': case(
+                (table.c.category == statement.excluded.category, table.c.count + statement.excluded.count),
+                else_=statement.excluded.count
+            ),
+            'last_used': statement.excluded.last_used
+        }
+    )
+    db.session.execute(statement, [
+        {'user_id': user_id, 'keyword': keyword, 'category': category, 'count': count, 'last_used': now}
+        for keyword, (category, count) in winners.items()
+    ])
+
+@app.route('/api/accounts/<int:account_id>/recategorize', methods=['POST'])
+@login_required
+def recategorize_account(account_id):
+    """Re-run the categoriser over an account's whole history"""
+    account = Account.query.filter_by(id=account_id, user_id=session['user_id']).first()
+    if not account:
+        return jsonify({'error': 'Invalid account ID'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    overwrite = bool(data.get('overwrite', False))
+    try:
+        min_confidence = float(data.get('min_confidence', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid min_confidence'}), 400
+    
+    started = time.perf_counter()
+    
+    query = select(
+        Transaction.id, Transaction.account_id, Transaction.description1, Transaction.category,
+        Transaction.debit_amount, Transaction.credit_amount
+    ).where(Transaction.account_id == account_id)
+    if not overwrite:
+        query = query.where(Transaction.category == 'Uncategorized')
+    rows = [row._asdict() for row in db.session.execute(query)]
+    
+    ruled = get_category_rules(session['user_id']).classify(rows)
+    learned, confidences = get_category_index(session['user_id']).classify(
+        [row['description1'] for row in rows]
+    )
+    
+    # Group changed rows by their new category so each gets one UPDATE per chunk.
+    # A matching rule is certain, so it is not held to min_confidence.
+    changes = {}
+    for row, rule_category, category, confidence in zip(rows, ruled, learned, confidences):
+        if rule_category:
+            category, confidence = rule_category, 1.0
+        if category and category != row['category'] and confidence >= min_confidence:
+            changes.setdefault(category, []).append(row['id'])
+    
+    table = Transaction.__table__
+    for category, ids in changes.items():
+        for chunk in chunked(ids, 5000):
+            db.session.execute(
+                update(table).where(table.c.id.in_(chunk)).values(category=category)
+            )
+    if changes:
+        rebuild_rollups([account_id])
+        bump_account_version(account_id)
+    db.session.commit()
+    
+    return jsonify({
+        'scanned': len(rows),
+        'updated': sum(len(ids) for ids in changes.values()),
+        'categories': {category: len(ids) for category, ids in changes.items()},
+        'elapsed_seconds': round(time.perf_counter() - started, 3)
+    })
+
+def parse_rule(data, user_id):
+    """Validate a rule definition from JSON; returns (column values, error message)"""
+    if data.get('category') not in CATEGORIES:
+        return None, 'Invalid category'
+    
+    match_type = data.get('match_type') or None
+    pattern = data.get('pattern') or None
+    if (match_type is None) != (pattern is None):
+        return None, 'match_type and pattern must be given together'
+    if match_type and match_type not in RULE_MATCH_TYPES:
+        return None, f"match_type must be one of {', '.join(RULE_MATCH_TYPES)}"
+    if pattern and (not isinstance(pattern, str) or len(pattern) > 255):
+        return None, 'pattern must be text of at most 255 characters'
+    if match_type == 'regex':
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return None, f'Invalid regex: {e}'
+    
+    account_id = data.get('account_id')
+    if account_id is not None:
+        account = Account.query.filter_by(id=account_id, user_id=user_id).first()
+        if not account:
+            return None, 'Invalid account ID'
+    
+    transaction_type = data.get('transaction_type') or None
+    if transaction_type and transaction_type not in TRANSACTION_TYPES:
+        return None, f"transaction_type must be one of {', '.join(TRANSACTION_TYPES)}"
+    
+    amounts = {}
+    for name in ('min_amount', 'max_amount'):
+        value = data.get(name)
+        if value is None or value == '':
+            amounts[name] = None
+            continue
+        try:
+            amounts[name] = Decimal(str(value))
+        except ArithmeticError:
+            return None, f'Invalid {name}'
+    if None not in amounts.values() and amounts['min_amount'] > amounts['max_amount']:
+        return None, 'min_amount is greater than max_amount'
+    
+    try:
+        priority = int(data.get('priority') or 0)
+    except (TypeError, ValueError):
+        return None, 'Invalid priority'
+    
+    values = {
+        'category': data['category'],
+        'match_type': match_type,
+        'pattern': pattern,
+        'account_id': account_id,
+        'transaction_type': transaction_type,
+        'priority': priority,
+        **amounts
+    }
+    if not any(values[name] is not None for name in ('pattern', 'account_id', 'transaction_type', 'min_amount', 'max_amount')):
+        return None, 'A rule needs at least one condition'
+    return values, None
+
+@app.route('/api/rules', methods=['GET'])
+@login_required
+def get_rules():
+    rules = CategoryRule.query.filter_by(user_id=session['user_id']).order_by(
+        CategoryRule.priority.desc(), CategoryRule.id
+    ).all()
+    return jsonify([rule.to_dict() for rule in rules])
+
+@app.route('/api/rules', methods=['POST'])
+@login_required
+def create_rule():
+    """Add a categorisation rule; applies to new uploads and re-categorisation"""
+    values, error = parse_rule(request.get_json(silent=True) or {}, session['user_id'])
+    if error:
+        return jsonify({'error': error}), 400
+    
+    rule = CategoryRule(user_id=session['user_id'], **values)
+    db.session.add(rule)
+    db.session.commit()
+    invalidate_category_rules(session['user_id'])
+    
+    return jsonify(rule.to_dict()), 201
+
+@app.route('/api/rules/<int:rule_id>', methods=['PUT'])
+@login_required
+def update_rule(rule_id):
+    rule = CategoryRule.query.filter_by(id=rule_id, user_id=session['user_id']).first()
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+    
+    values, error = parse_rule(request.get_json(silent=True) or {}, session['user_id'])
+    if error:
+        return jsonify({'error': error}), 400
+    
+    for name, value in values.items():
+        setattr(rule, name, value)
+    db.session.commit()
+    invalidate_category_rules(session['user_id'])
+    
+    return jsonify(rule.to_dict())
+
+@app.route('/api/rules/<int:rule_id>', methods=['DELETE'])
+@login_required
+def delete_rule(rule_id):
+    rule = CategoryRule.query.filter_by(id=rule_id, user_id=session['user_id']).first()
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+    
+    db.session.delete(rule)
+    db.session.commit()
+    invalidate_category_rules(session['user_id'])
+    
+    return jsonify({'success': True})
+
 @app.route('/analysis')
 @login_required
 def analysis():
     accounts = Account.query.filter_by(user_id=session['user_id']).all()
     return render_template('analysis.html', accounts=accounts, categories=CATEGORIES)
 
+# Aggregate queries behind the analysis endpoints
+
+def spending_sum(column):
+    """SUM of the positive values of an amount column"""
+    return func.coalesce(func.sum(case((column > 0, column), else_=0)), 0)
+
+def month_key(column):
+    """Expression formatting a date column as 'YYYY-MM' in the database"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def dialect_insert(table):
+    """INSERT construct with ON CONFLICT support for the configured database"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(table)
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    return sqlite_insert(table)
+
+def add_rollup_deltas(deltas, transactions, sign=1):
+    """Accumulate transaction amounts into {(month, category): [spending, income, count]}"""
+    for transaction in transactions:
+        posted_date = transaction['posted_date']
+        month = posted_date.strftime('%Y-%m') if posted_date else NO_MONTH
+        key = (month, transaction['category'] or 'Uncategorized')
+        totals = deltas.setdefault(key, [0, 0, 0])
+        debit = transaction['debit_amount'] or 0
+        credit = transaction['credit_amount'] or 0
+        if debit > 0:
+            totals[0] += sign * debit
+        if credit > 0:
+            totals[1] += sign * credit
+        totals[2] += sign
+
+def apply_rollup_deltas(account_id, deltas):
+    """Add accumulated deltas to an account's rollup rows in one upsert"""
+    if not deltas:
+        return
+    
+    table = MonthlyRollup.__table__
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['account_id', 'month', 'category'],
+        set_={
+            'spending': table.c.spending + statement.excluded.spending,
+            'income': table.c.income + statement.excluded.income,
+            'transaction_count': table.c.transaction_count + statement.excluded.transaction_count
+        }
+    )
+    db.session.execute(statement, [
+        {
+            'account_id': int(account_id),
+            'month': month,
+            'category': category,
+            'spending': spending,
+            'income': income,
+            'transaction_count': count
+        }
+        for (month, category), (spending, income, count) in deltas.items()
+    ])
+    
+    # Drop rows whose last transaction moved to another category
+    db.session.execute(
+        delete(table).where(table.c.account_id == int(account_id), table.c.transaction_count <= 0)
+    )
+
+def raw_rollup_query(account_ids=None):
+    """Aggregate the transaction table into rollup-shaped rows"""
+    month = func.coalesce(month_key(Transaction.posted_date), NO_MONTH)
+    category = func.coalesce(Transaction.category, 'Uncategorized')
+    query = select(
+        Transaction.account_id,
+        month,
+        category,
+        spending_sum(Transaction.debit_amount),
+        spending_sum(Transaction.credit_amount),
+        func.count()
+    ).group_by(Transaction.account_id, month, category)
+    if account_ids is not None:
+        query = query.where(Transaction.account_id.in_(account_ids))
+    return query
+
+def rebuild_rollups(account_ids=None):
+    """Recompute rollup rows from the transaction table (all accounts by default)"""
+    table = MonthlyRollup.__table__
+    clear = delete(table)
+    if account_ids is not None:
+        clear = clear.where(table.c.account_id.in_(account_ids))
+    db.session.execute(clear)
+    db.session.execute(
+        insert(table).from_select(
+            ['account_id', 'month', 'category', 'spending', 'income', 'transaction_count'],
+            raw_rollup_query(account_ids)
+        )
+    )
+
+def check_rollups(account_ids=None):
+    """Compare rollup rows with the transaction table to the cent; returns a list of mismatches"""
+    expected = {
+        (account_id, month, category): (spending, income, count)
+        for account_id, month, category, spending, income, count
+        in db.session.execute(raw_rollup_query(account_ids))
+    }
+    
+    query = select(
+        MonthlyRollup.account_id, MonthlyRollup.month, MonthlyRollup.category,
+        MonthlyRollup.spending, MonthlyRollup.income, MonthlyRollup.transaction_count
+    )
+    if account_ids is not None:
+        query = query.where(MonthlyRollup.account_id.in_(account_ids))
+    actual = {
+        (account_id, month, category): (spending, income, count)
+        for account_id, month, category, spending, income, count in db.session.execute(query)
+    }
+    
+    mismatches = []
+    for key in sorted(set(expected) | set(actual)):
+        want = expected.get(key, (0, 0, 0))
+        got = actual.get(key, (0, 0, 0))
+        if (to_cents(want[0]) != to_cents(got[0])
+                or to_cents(want[1]) != to_cents(got[1])
+                or want[2] != got[2]):
+            mismatches.append({'key': key, 'expected': want, 'actual': got})
+    return mismatches
+
+def next_month(day):
+    """First day of the month after the given date"""
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def raw_category_spending(account_ids, start_date=None, end_date=None):
+    """Return (category, spending) rows summed from raw transactions"""
+    category = func.coalesce(Transaction.category, 'Uncategorized')
+    query = select(category, spending_sum(Transaction.debit_amount)).where(
+        Transaction.account_id.in_(account_ids)
+    )
+    if start_date:
+        query = query.where(Transaction.posted_date >= start_date)
+    if end_date:
+        query = query.where(Transaction.posted_date <= end_date)
+    
+    return db.session.execute(query.group_by(category)).all()
+
+def category_spending_totals(account_ids, start_date=None, end_date=None):
+    """Return (category, spending) rows summed over the given accounts.
+    
+    Whole months come from the rollup table; only the partial months at the
+    edges of a date range are summed from raw transactions.
+    """
+    query = select(MonthlyRollup.category, func.sum(MonthlyRollup.spending)).where(
+        MonthlyRollup.account_id.in_(account_ids)
+    ).group_by(MonthlyRollup.category)
+    
+    if not start_date and not end_date:
+        return db.session.execute(query).all()
+    
+    # Whole months inside the range; rows without a date only count unfiltered
+    first_month = start_date if not start_date or start_date.day == 1 else next_month(start_date)
+    after_last_month = None
+    if end_date:
+        month_ends = (end_date + timedelta(days=1)).day == 1
+        after_last_month = next_month(end_date) if month_ends else end_date.replace(day=1)
+    
+    if first_month and after_last_month and first_month >= after_last_month:
+        return raw_category_spending(account_ids, start_date, end_date)
+    
+    query = query.where(MonthlyRollup.month != NO_MONTH)
+    if first_month:
+        query = query.where(MonthlyRollup.month >= first_month.strftime('%Y-%m'))
+    if after_last_month:
+        query = query.where(MonthlyRollup.month < after_last_month.strftime('%Y-%m'))
+    
+    totals = {}
+    parts = [db.session.execute(query).all()]
+    if start_date and start_date < first_month:
+        parts.append(raw_category_spending(account_ids, start_date, first_month - timedelta(days=1)))
+    if end_date and end_date >= after_last_month:
+        parts.append(raw_category_spending(account_ids, after_last_month, end_date))
+    for rows in parts:
+        for category, spending in rows:
+            totals[category] = totals.get(category, 0) + (spending or 0)
+    return list(totals.items())
+
+def monthly_totals(account_ids):
+    """Return (month, spending, income) rows summed over the given accounts, oldest month first"""
+    query = select(
+        MonthlyRollup.month,
+        func.sum(MonthlyRollup.spending),
+        func.sum(MonthlyRollup.income)
+    ).where(
+        MonthlyRollup.account_id.in_(account_ids),
+        MonthlyRollup.month != NO_MONTH
+    ).group_by(MonthlyRollup.month).order_by(MonthlyRollup.month)
+    
+    return db.session.execute(query).all()
+
 @app.route('/api/analysis/spending-by-category', methods=['GET'])
 @login_required
+@cached_response
 def spending_by_category():
     account_id = request.args.get('account_id')
     start_date = request.args.get('start_date')
@@ -502,38 +3032,23 @@ def spending_by_category():
     if not account:
         return jsonify({'error': 'Invalid account ID'}), 400
     
-    query = Transaction.query.filter_by(account_id=account_id)
-    
     if start_date:
         try:
             start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.posted_date >= start_date)
         except ValueError:
-            pass
+            start_date = None
     
     if end_date:
         try:
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(Transaction.posted_date <= end_date)
         except ValueError:
-            pass
-    
-    transactions = query.all()
+            end_date = None
     
-    # Calculate spending by category
-    category_spending = {}
-    for transaction in transactions:
-        category = transaction.category or "Uncategorized"
-        if category not in category_spending:
-            category_spending[category] = 0
-        
-        # Add debit amount (spending)
-        if transaction.debit_amount > 0:
-            category_spending[category] += transaction.debit_amount
+    totals = category_spending_totals([account.id], start_date, end_date)
     
     # Format for chart.js
-    labels = list(category_spending.keys())
-    data = [round(category_spending[label], 2) for label in labels]
+    labels = [category for category, _ in totals]
+    data = [round(float(spending), 2) for _, spending in totals]
     
     return jsonify({
         'labels': labels,
@@ -542,6 +3057,7 @@ def spending_by_category():
 
 @app.route('/api/analysis/monthly-spending', methods=['GET'])
 @login_required
+@cached_response
 def monthly_spending():
     account_id = request.args.get('account_id')
     
@@ -552,46 +3068,925 @@ def monthly_spending():
     if not account:
         return jsonify({'error': 'Invalid account ID'}), 400
     
-    transactions = Transaction.query.filter_by(account_id=account_id).all()
+    totals = monthly_totals([account.id])
     
-    # Calculate monthly spending
-    monthly_data = {}
-    for transaction in transactions:
-        if not transaction.posted_date:
+    spending_data = [round(float(spending), 2) for _, spending, _ in totals]
+    income_data = [round(float(income), 2) for _, _, income in totals]
+    
+    return jsonify({
+        'labels': month_labels([month for month, _, _ in totals]),
+        'spending': spending_data,
+        'income': income_data
+    })
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+def month_labels(months):
+    """Chart labels like 'Jan 2025' for 'YYYY-MM' month keys"""
+    labels = []
+    for month in months:
+        year, month_num = month.split('-')
+        labels.append(f"{MONTH_NAMES[int(month_num)-1]} {year}")
+    return labels
+
+# Household analysis: every account of the user at once, with money moved
+# between those accounts netted out
+
+def shift_days(column, days):
+    """Expression for a date column moved by a number of days"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column, f'{days:+d} days')
+    return column + timedelta(days=days)
+
+def find_transfers(account_ids, window_days, start_date=None, end_date=None):
+    """Pair debits in one account with credits of the same amount in another.
+    
+    One query joins debits to credits on the exact amount, so the database
+    matches them with a hash join or index lookup rather than comparing every
+    pair, and keeps only credits within window_days of the debit. Each
+    transaction then joins at most one pair, closest dates first.
+    Returns dicts with both legs' ids, accounts and dates, the debit's
+    category and the amount.
+    """
+    debit = aliased(Transaction)
+    credit = aliased(Transaction)
+    query = select(
+        debit.id, debit.account_id, debit.posted_date, debit.category,
+        credit.id, credit.account_id, credit.posted_date, debit.debit_amount
+    ).join(credit, and_(
+        credit.credit_amount == debit.debit_amount,
+        credit.account_id != debit.account_id,
+        credit.account_id.in_(account_ids),
+        credit.posted_date >= shift_days(debit.posted_date, -window_days),
+        credit.posted_date <= shift_days(debit.posted_date, window_days)
+    )).where(
+        debit.account_id.in_(account_ids),
+        debit.debit_amount > 0
+    )
+    # A pair counts when either leg is in range, so widen by the window
+    if start_date:
+        query = query.where(debit.posted_date >= start_date - timedelta(days=window_days))
+    if end_date:
+        query = query.where(debit.posted_date <= end_date + timedelta(days=window_days))
+    candidates = db.session.execute(query).all()
+    
+    candidates.sort(key=lambda c: (abs((c[6] - c[2]).days), c[2], c[0], c[4]))
+    used = set()
+    transfers = []
+    for debit_id, debit_account, debit_date, category, credit_id, credit_account, credit_date, amount in candidates:
+        if debit_id in used or credit_id in used:
             continue
+        used.update((debit_id, credit_id))
+        transfers.append({
+            'debit_id': debit_id,
+            'debit_account_id': debit_account,
+            'debit_date': debit_date,
+            'category': category or 'Uncategorized',
+            'credit_id': credit_id,
+            'credit_account_id': credit_account,
+            'credit_date': credit_date,
+            'amount': amount
+        })
+    transfers.sort(key=lambda t: (t['debit_date'], t['debit_id']))
+    return transfers
+
+def household_request():
+    """The user's account ids and the transfer window for a household view"""
+    account_ids = [account_id for account_id, in db.session.execute(
+        select(Account.id).where(Account.user_id == session['user_id'])
+    )]
+    try:
+        window_days = int(request.args.get('window_days', app.config['TRANSFER_WINDOW_DAYS']))
+    except ValueError:
+        raise ValueError('Invalid window_days')
+    if not 0 <= window_days <= 31:
+        raise ValueError('window_days must be between 0 and 31')
+    return account_ids, window_days
+
+def parse_date_range(args):
+    """start_date and end_date query parameters as dates; raises ValueError on bad input"""
+    dates = []
+    for name in ('start_date', 'end_date'):
+        value = args.get(name)
+        try:
+            dates.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+        except ValueError:
+            raise ValueError(f'Invalid {name}, expected YYYY-MM-DD')
+    return dates
+
+@app.route('/api/analysis/household/spending-by-category', methods=['GET'])
+@login_required
+@cached_household_response
+def household_spending_by_category():
+    """Spending by category across all accounts, without transfers between them"""
+    try:
+        account_ids, window_days = household_request()
+        start_date, end_date = parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    totals = dict(category_spending_totals(account_ids, start_date, end_date))
+    netted = Decimal(0)
+    for transfer in find_transfers(account_ids, window_days, start_date, end_date):
+        if (start_date and transfer['debit_date'] < start_date) or (end_date and transfer['debit_date'] > end_date):
+            continue
+        totals[transfer['category']] -= transfer['amount']
+        netted += transfer['amount']
+    
+    totals = [(category, spending) for category, spending in totals.items() if spending]
+    return jsonify({
+        'labels': [category for category, _ in totals],
+        'data': [round(float(spending), 2) for _, spending in totals],
+        'transfers_netted': money(netted)
+    })
+
+@app.route('/api/analysis/household/monthly-spending', methods=['GET'])
+@login_required
+@cached_household_response
+def household_monthly_spending():
+    """Monthly spending and income across all accounts, without transfers between them"""
+    try:
+        account_ids, window_days = household_request()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    totals = {month: [spending, income, Decimal(0)] for month, spending, income in monthly_totals(account_ids)}
+    for transfer in find_transfers(account_ids, window_days):
+        amount = transfer['amount']
+        debit_month = totals[transfer['debit_date'].strftime('%Y-%m')]
+        debit_month[0] -= amount
+        debit_month[2] += amount
+        totals[transfer['credit_date'].strftime('%Y-%m')][1] -= amount
+    
+    months = sorted(totals)
+    return jsonify({
+        'labels': month_labels(months),
+        'spending': [round(float(totals[month][0]), 2) for month in months],
+        'income': [round(float(totals[month][1]), 2) for month in months],
+        'transfers': [round(float(totals[month][2]), 2) for month in months]
+    })
+
+@app.route('/api/analysis/household/transfers', methods=['GET'])
+@login_required
+@cached_household_response
+def household_transfers():
+    """The transfers between the user's accounts that household totals leave out"""
+    try:
+        account_ids, window_days = household_request()
+        start_date, end_date = parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    transfers = find_transfers(account_ids, window_days, start_date, end_date)
+    return jsonify([{
+        **transfer,
+        'debit_date': transfer['debit_date'].strftime('%Y-%m-%d'),
+        'credit_date': transfer['credit_date'].strftime('%Y-%m-%d'),
+        'amount': money(transfer['amount'])
+    } for transfer in transfers])
+
+# Columnar analytics: a per-user snapshot of transactions as typed NumPy
+# arrays, memory-mapped from .npy files, behind the time-series endpoints
+
+SNAPSHOT_COLUMNS = {
+    'id': 'int64',
+    'day': 'int32',
+    'account_id': 'int32',
+    'category': 'int16',
+    'merchant': 'int32',
+    'debit': 'int64',
+    'credit': 'int64',
+    'balance': 'int64'
+}
+
+# Balance of rows whose export had none, the smallest int64
+NO_BALANCE = -2 ** 63
+
+# Ordinal of 1970-01-01, where datetime64 day counts start
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Old snapshot files are kept this long for readers that opened them just before a refresh
+SNAPSHOT_RETENTION_SECONDS = 60
+
+class AnalyticsSnapshot:
+    """Columnar copy of a user's transactions for vectorised analysis.
+    
+    One array per column in id order: the posted date as a day ordinal (0 when
+    missing), the account, a category code into self.categories, a merchant
+    code into self.merchants, and debit, credit and balance in whole cents.
+    Snapshots are saved as .npy files and memory-mapped back, so a worker only
+    pages in the columns a query reads.
+    versions holds each account's data_version when the snapshot was taken.
+    """
+    def __init__(self, columns=None, categories=None, merchants=None, versions=None):
+        self.columns = columns or {name: np.empty(0, dtype) for name, dtype in SNAPSHOT_COLUMNS.items()}
+        self.categories = categories or []
+        self.merchants = merchants or []
+        self.versions = versions or {}
+    
+    def __getitem__(self, name):
+        return self.columns[name]
+    
+    def __len__(self):
+        return len(self.columns['id'])
+    
+    @property
+    def max_id(self):
+        return int(self.columns['id'][-1]) if len(self) else 0
+    
+    @classmethod
+    def load(cls, folder):
+        """Memory-map the snapshot saved in folder, or None if there is none"""
+        try:
+            with open(os.path.join(folder, 'meta.json')) as f:
+                meta = json.load(f)
+            path = os.path.join(folder, meta['generation'])
+            columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in SNAPSHOT_COLUMNS}
+        except (OSError, ValueError, KeyError):
+            return None
+        versions = {int(account_id): version for account_id, version in meta['versions'].items()}
+        return cls(columns, meta['categories'], meta['merchants'], versions)
+    
+    def save(self, folder):
+        """Write the columns to a new generation directory, then switch meta.json to it.
         
-        month_key = transaction.posted_date.strftime('%Y-%m')
-        if month_key not in monthly_data:
-            monthly_data[month_key] = {
-                'spending': 0,
-                'income': 0
-            }
+        meta.json is replaced atomically, so readers in other workers see
+        either the old snapshot or the new one, never a mix.
+        """
+        generation = uuid.uuid4().hex
+        path = os.path.join(folder, generation)
+        os.makedirs(path)
+        for name, dtype in SNAPSHOT_COLUMNS.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.asarray(self.columns[name], dtype=dtype))
         
-        if transaction.debit_amount > 0:
-            monthly_data[month_key]['spending'] += transaction.debit_amount
+        temporary = os.path.join(folder, f'meta.{generation}.tmp')
+        with open(temporary, 'w') as f:
+            json.dump({
+                'generation': generation,
+                'categories': self.categories,
+                'merchants': self.merchants,
+                'versions': self.versions
+            }, f)
+        os.replace(temporary, os.path.join(folder, 'meta.json'))
         
-        if transaction.credit_amount > 0:
-            monthly_data[month_key]['income'] += transaction.credit_amount
+        cutoff = time.time() - SNAPSHOT_RETENTION_SECONDS
+        for entry in os.scandir(folder):
+            if entry.is_dir() and entry.name != generation and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def cents_column(column):
+    """Expression for an amount column in whole cents"""
+    return cast(func.round(column * 100), BigInteger)
+
+def snapshot_query():
+    table = Transaction.__table__
+    return select(
+        table.c.id, table.c.posted_date, table.c.account_id, table.c.category,
+        table.c.description1, table.c.description2, table.c.description3,
+        func.coalesce(cents_column(table.c.debit_amount), 0),
+        func.coalesce(cents_column(table.c.credit_amount), 0),
+        cents_column(table.c.balance)
+    )
+
+def snapshot_columns(rows, lookup, merchant_lookup):
+    """Typed column arrays for rows of snapshot_query().
     
-    # Convert to sorted list for chart
-    months = sorted(monthly_data.keys())
-    spending_data = [round(monthly_data[month]['spending'], 2) for month in months]
-    income_data = [round(monthly_data[month]['income'], 2) for month in months]
+    New categories and merchant keys are added to lookup and merchant_lookup,
+    which map them to codes.
+    """
+    if not rows:
+        return AnalyticsSnapshot().columns
+    (ids, dates, accounts, categories, descriptions1, descriptions2, descriptions3,
+     debits, credits, balances) = zip(*rows)
+    merchants = (
+        merchant_key(' '.join(d for d in descriptions if d))
+        for descriptions in zip(descriptions1, descriptions2, descriptions3)
+    )
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'day': np.fromiter((d.toordinal() if d else 0 for d in dates), dtype=np.int32, count=len(rows)),
+        'account_id': np.array(accounts, dtype=np.int32),
+        'category': np.fromiter(
+            (lookup.setdefault(c or 'Uncategorized', len(lookup)) for c in categories),
+            dtype=np.int16, count=len(rows)
+        ),
+        'merchant': np.fromiter(
+            (merchant_lookup.setdefault(m, len(merchant_lookup)) for m in merchants),
+            dtype=np.int32, count=len(rows)
+        ),
+        'debit': np.array(debits, dtype=np.int64),
+        'credit': np.array(credits, dtype=np.int64),
+        'balance': np.fromiter(
+            (NO_BALANCE if b is None else b for b in balances), dtype=np.int64, count=len(rows)
+        )
+    }
+
+def refresh_snapshot(snapshot, versions):
+    """A copy of snapshot brought up to date with the database.
     
-    # Format month labels
-    month_labels = []
-    for month in months:
-        year, month_num = month.split('-')
-        month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        month_labels.append(f"{month_names[int(month_num)-1]} {year}")
+    Transactions newer than the snapshot are appended. Accounts whose
+    data_version moved may also have had categories changed, so their older
+    rows have only their categories re-read; rows that committed after the
+    snapshot with lower ids are fetched whole, and rows of accounts that are
+    gone are dropped.
+    """
+    table = Transaction.__table__
+    max_id = snapshot.max_id
+    lookup = {category: code for code, category in enumerate(snapshot.categories)}
+    merchant_lookup = {merchant: code for code, merchant in enumerate(snapshot.merchants)}
+    columns = dict(snapshot.columns)
+    
+    keep = np.isin(columns['account_id'], list(versions))
+    changed = [account_id for account_id, version in versions.items()
+               if snapshot.versions.get(account_id) not in (None, version)]
+    late_ids = []
+    if changed and max_id:
+        rows = db.session.execute(
+            select(table.c.id, table.c.category)
+            .where(table.c.account_id.in_(changed), table.c.id <= max_id)
+            .order_by(table.c.id)
+        ).all()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        positions = np.minimum(np.searchsorted(columns['id'], ids), max(len(snapshot) - 1, 0))
+        present = columns['id'][positions] == ids if len(snapshot) else np.zeros(len(ids), dtype=bool)
+        
+        codes = np.array(columns['category'])
+        codes[positions[present]] = [
+            lookup.setdefault(row[1] or 'Uncategorized', len(lookup))
+            for row, found in zip(rows, present) if found
+        ]
+        columns['category'] = codes
+        late_ids = ids[~present].tolist()
+        keep &= ~np.isin(columns['account_id'], changed) | np.isin(columns['id'], ids)
+    
+    rows = db.session.execute(
+        snapshot_query().where(table.c.account_id.in_(list(versions)), table.c.id > max_id).order_by(table.c.id)
+    ).all()
+    for batch in chunked(late_ids, 10000):
+        rows.extend(db.session.execute(snapshot_query().where(table.c.id.in_(batch))).all())
+    added = snapshot_columns(rows, lookup, merchant_lookup)
+    
+    merged = {name: np.concatenate([np.asarray(columns[name])[keep], added[name]]) for name in SNAPSHOT_COLUMNS}
+    if late_ids:
+        order = np.argsort(merged['id'], kind='stable')
+        merged = {name: values[order] for name, values in merged.items()}
+    return AnalyticsSnapshot(merged, list(lookup), list(merchant_lookup), dict(versions))
+
+snapshots = {}
+snapshot_lock = threading.Lock()
+
+def snapshot_folder(user_id):
+    """Where a user's snapshot lives; separate per database, since user ids repeat across them"""
+    database = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    return os.path.join(app.config['SNAPSHOT_FOLDER'], database, f'user_{user_id}')
+
+def get_snapshot(user_id):
+    """The user's analytics snapshot, refreshed first if any account changed.
+    
+    Versions are read before any rows, so a refresh racing an upload can only
+    leave the snapshot looking older than it is, and the next call catches up.
+    """
+    versions = dict(db.session.execute(
+        select(Account.id, Account.data_version).where(Account.user_id == user_id)
+    ).all())
+    with snapshot_lock:
+        snapshot = snapshots.get(user_id)
+        if snapshot is not None and snapshot.versions == versions:
+            return snapshot
+        
+        # Another worker may already have written an up to date snapshot
+        folder = snapshot_folder(user_id)
+        snapshot = AnalyticsSnapshot.load(folder) or snapshot or AnalyticsSnapshot()
+        if snapshot.versions != versions:
+            os.makedirs(folder, exist_ok=True)
+            refresh_snapshot(snapshot, versions).save(folder)
+            snapshot = AnalyticsSnapshot.load(folder)
+        snapshots[user_id] = snapshot
+        return snapshot
+
+def refresh_snapshot_job(user_id):
+    """Bring a user's saved snapshot and recurring items up to date in a worker thread after an upload"""
+    with app.app_context():
+        try:
+            get_recurring(user_id)
+        except Exception as e:
+            app.logger.error(f"Error refreshing analytics snapshot for user {user_id}: {str(e)}")
+            app.logger.error(traceback.format_exc())
+
+def schedule_snapshot_refresh(user_id):
+    """Refresh the user's snapshot after new data, if they have one.
+    
+    Users who never open the analytics endpoints get no snapshot; the
+    first request builds it.
+    """
+    if os.path.isdir(snapshot_folder(user_id)):
+        ingest_executor.submit(refresh_snapshot_job, user_id)
+
+SNAPSHOT_METRICS = ('spending', 'income', 'net', 'count')
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+def snapshot_selection(snapshot, args, dated=False):
+    """Boolean mask of rows matching the account_id, category and date range parameters.
+    
+    dated=True also drops rows without a posted date. Raises ValueError on bad input.
+    """
+    mask = np.ones(len(snapshot), dtype=bool)
+    account_id = args.get('account_id')
+    if account_id:
+        if not account_id.isdigit() or int(account_id) not in snapshot.versions:
+            raise ValueError('Invalid account ID')
+        mask &= snapshot['account_id'] == int(account_id)
+    category = args.get('category')
+    if category:
+        code = snapshot.categories.index(category) if category in snapshot.categories else -1
+        mask &= snapshot['category'] == code
+    start_date, end_date = parse_date_range(args)
+    if start_date:
+        mask &= snapshot['day'] >= start_date.toordinal()
+    if end_date:
+        mask &= snapshot['day'] <= end_date.toordinal()
+    if dated:
+        mask &= snapshot['day'] > 0
+    return mask
+
+def snapshot_metric(snapshot, args, mask):
+    """The metric parameter's per-row values for the selected rows, in cents (or ones for count)"""
+    metric = args.get('metric', 'spending')
+    if metric not in SNAPSHOT_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(SNAPSHOT_METRICS)}")
+    if metric == 'spending':
+        return metric, snapshot['debit'][mask]
+    if metric == 'income':
+        return metric, snapshot['credit'][mask]
+    if metric == 'net':
+        return metric, snapshot['credit'][mask] - snapshot['debit'][mask]
+    return metric, np.ones(int(mask.sum()), dtype=np.int64)
+
+def metric_output(metric, values):
+    """Summed cents as JSON amounts, or counts as integers"""
+    values = np.asarray(values)
+    if metric == 'count':
+        return values.astype(np.int64).tolist()
+    return (values / 100).round(2).tolist()
+
+def grouped_sums(codes, shape, values):
+    """Sum values into an array of the given shape, indexed by one code array per axis"""
+    flat = np.ravel_multi_index(codes, shape) if len(shape) > 1 else codes[0]
+    # bincount sums in float64, exact for cent totals below 2**53
+    sums = np.bincount(flat, weights=values, minlength=int(np.prod(shape)))
+    return np.rint(sums).astype(np.int64).reshape(shape)
+
+def day_labels(days):
+    """'YYYY-MM-DD' strings for day ordinals"""
+    return (np.asarray(days, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]').astype(str).tolist()
+
+def group_keys(snapshot, mask, dimension):
+    """(codes, labels) grouping the selected rows by one dimension"""
+    if dimension == 'account':
+        labels, codes = np.unique(snapshot['account_id'][mask], return_inverse=True)
+        return codes, labels.tolist()
+    if dimension == 'category':
+        labels, codes = np.unique(snapshot['category'][mask], return_inverse=True)
+        return codes, [snapshot.categories[code] for code in labels]
+    if dimension == 'weekday':
+        return (snapshot['day'][mask] - 1) % 7, WEEKDAY_NAMES
+    
+    dates = (snapshot['day'][mask].astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    if dimension == 'year':
+        values = dates.astype('datetime64[Y]')
+    elif dimension == 'month':
+        values = dates.astype('datetime64[M]')
+    elif dimension == 'month_of_year':
+        return dates.astype('datetime64[M]').astype(np.int64) % 12, MONTH_NAMES
+    else:
+        values = dates
+    labels, codes = np.unique(values, return_inverse=True)
+    labels = labels.astype(str).tolist()
+    return codes, [int(label) for label in labels] if dimension == 'year' else labels
+
+GROUP_DIMENSIONS = ('account', 'category', 'year', 'month', 'month_of_year', 'weekday', 'day')
+DATED_DIMENSIONS = ('year', 'month', 'month_of_year', 'weekday', 'day')
+
+@app.route('/api/analytics/rolling', methods=['GET'])
+@login_required
+@cached_household_response
+def rolling_totals():
+    """Daily totals and their sum over a trailing window of days, one point per day.
+    
+    Accepts window (days, default 30), metric (spending, income, net or
+    count), account_id, category, start_date and end_date.
+    """
+    try:
+        window = int(request.args.get('window', 30))
+    except ValueError:
+        return jsonify({'error': 'Invalid window'}), 400
+    if not 1 <= window <= 366:
+        return jsonify({'error': 'window must be between 1 and 366 days'}), 400
+    
+    snapshot = get_snapshot(session['user_id'])
+    try:
+        mask = snapshot_selection(snapshot, request.args, dated=True)
+        metric, values = snapshot_metric(snapshot, request.args, mask)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    days = snapshot['day'][mask]
+    if not len(days):
+        return jsonify({'labels': [], 'daily': [], 'rolling': [], 'window': window})
+    first, last = int(days.min()), int(days.max())
+    
+    daily = grouped_sums([days - first], (last - first + 1,), values)
+    cumulative = np.concatenate(([0], np.cumsum(daily)))
+    ends = np.arange(1, len(daily) + 1)
+    rolling = cumulative[ends] - cumulative[np.maximum(ends - window, 0)]
     
     return jsonify({
-        'labels': month_labels,
-        'spending': spending_data,
-        'income': income_data
+        'labels': day_labels(np.arange(first, last + 1)),
+        'daily': metric_output(metric, daily),
+        'rolling': metric_output(metric, rolling),
+        'window': window
+    })
+
+@app.route('/api/analytics/year-over-year', methods=['GET'])
+@login_required
+@cached_household_response
+def year_over_year():
+    """Yearly totals per group with the percentage change on the year before.
+    
+    by groups rows by category (default), account or month_of_year; also
+    accepts metric, account_id, category, start_date and end_date. A change
+    is null when the year before has no total.
+    """
+    by = request.args.get('by', 'category')
+    if by not in ('category', 'account', 'month_of_year'):
+        return jsonify({'error': 'by must be category, account or month_of_year'}), 400
+    
+    snapshot = get_snapshot(session['user_id'])
+    try:
+        mask = snapshot_selection(snapshot, request.args, dated=True)
+        metric, values = snapshot_metric(snapshot, request.args, mask)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    year_codes, years = group_keys(snapshot, mask, 'year')
+    codes, labels = group_keys(snapshot, mask, by)
+    totals = grouped_sums([codes, year_codes], (len(labels), len(years)), values)
+    present = grouped_sums([codes], (len(labels),), np.ones(len(codes))) > 0
+    
+    def changes(series):
+        if not len(series):
+            return []
+        previous, current = series[..., :-1], series[..., 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.round((current - previous) / np.abs(previous) * 100, 1)
+        return [None] + [None if p == 0 else value for p, value in zip(previous.tolist(), percent.tolist())]
+    
+    overall = totals.sum(axis=0)
+    return jsonify({
+        'years': years,
+        'totals': metric_output(metric, overall),
+        'change_percent': changes(overall),
+        'groups': [{
+            'key': labels[i],
+            'totals': metric_output(metric, totals[i]),
+            'change_percent': changes(totals[i])
+        } for i in np.flatnonzero(present)]
     })
 
+@app.route('/api/analytics/group-by', methods=['GET'])
+@login_required
+@cached_household_response
+def group_by_totals():
+    """Totals grouped by any combination of dimensions.
+    
+    by is a comma-separated list of account, category, year, month,
+    month_of_year, weekday and day; also accepts metric, account_id,
+    category, start_date and end_date. Returns one row per group that has
+    transactions, in key order.
+    """
+    dimensions = [d.strip() for d in request.args.get('by', 'category').split(',') if d.strip()]
+    unknown = [d for d in dimensions if d not in GROUP_DIMENSIONS]
+    if not dimensions or unknown or len(set(dimensions)) != len(dimensions):
+        return jsonify({'error': f"by must be distinct dimensions from {', '.join(GROUP_DIMENSIONS)}"}), 400
+    
+    snapshot = get_snapshot(session['user_id'])
+    try:
+        dated = any(d in DATED_DIMENSIONS for d in dimensions)
+        mask = snapshot_selection(snapshot, request.args, dated=dated)
+        metric, values = snapshot_metric(snapshot, request.args, mask)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    keys = [group_keys(snapshot, mask, d) for d in dimensions]
+    shape = tuple(len(labels) for _, labels in keys)
+    codes = [codes for codes, _ in keys]
+    flat = np.ravel_multi_index(codes, shape) if len(codes[0]) else np.empty(0, dtype=np.int64)
+    groups, inverse = np.unique(flat, return_inverse=True)
+    totals = grouped_sums([inverse], (len(groups),), values)
+    counts = np.bincount(inverse, minlength=len(groups))
+    
+    positions = np.unravel_index(groups, shape)
+    rows = []
+    for i, total in enumerate(metric_output(metric, totals)):
+        row = {d: keys[axis][1][positions[axis][i]] for axis, d in enumerate(dimensions)}
+        row['value'] = total
+        row['transactions'] = int(counts[i])
+        rows.append(row)
+    return jsonify(rows)
+
+# Recurring payments: merchants that repeat at a steady interval and amount,
+# detected over the analytics snapshot
+
+# period -> (lowest and highest median interval in days, allowed deviation of one interval)
+RECURRING_PERIODS = {
+    'weekly': (6, 8, 1),
+    'fortnightly': (12, 16, 2),
+    'monthly': (26, 35, 4),
+    'quarterly': (82, 100, 10),
+    'yearly': (345, 385, 20)
+}
+
+# Periods that step by calendar months rather than days
+MONTHS_PER_PERIOD = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+
+# Share of a merchant's intervals and of its amounts that must fit the pattern
+RECURRING_REGULARITY = 0.75
+
+def group_medians(values, groups, count):
+    """Median of values within each of count groups (NaN for empty ones), sorting once"""
+    order = np.lexsort((values, groups))
+    ordered = values[order].astype(np.float64)
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.cumsum(sizes) - sizes
+    present = sizes > 0
+    medians = np.full(count, np.nan)
+    lower = starts[present] + (sizes[present] - 1) // 2
+    upper = starts[present] + sizes[present] // 2
+    medians[present] = (ordered[lower] + ordered[upper]) / 2
+    return medians
+
+def add_months(day, months):
+    """The same day of the month some months later, clamped to the month's end"""
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def recurrence(last, period, interval_days, n):
+    """The date of the nth occurrence after last"""
+    months = MONTHS_PER_PERIOD.get(period)
+    if months:
+        return add_months(last, n * months)
+    return last + timedelta(days=n * round(interval_days))
+
+def detect_recurring(snapshot, account_ids, amount_tolerance):
+    """Recurring items in the given accounts, as {account_id: [item, ...]}.
+    
+    Occurrences are grouped by account, merchant key and direction and sorted
+    by date once, so intervals and medians for every group come from whole-
+    array operations. A group recurs when its median interval fits a period,
+    it has at least three occurrences (two for yearly), and most intervals
+    and amounts sit within tolerance of their medians. Same-day repeats count
+    as one occurrence of their total. An item has stopped (active is false)
+    when its account's data runs past the next due date by more than the
+    period allows.
+    """
+    result = {account_id: [] for account_id in account_ids}
+    day, account = snapshot['day'], snapshot['account_id']
+    selected = (day > 0) & np.isin(account, list(account_ids))
+    if not selected.any():
+        return result
+    
+    # Each account's newest date, where its exports end
+    accounts, inverse = np.unique(account[selected], return_inverse=True)
+    newest = np.zeros(len(accounts), dtype=np.int64)
+    np.maximum.at(newest, inverse, day[selected])
+    newest = dict(zip(accounts.tolist(), newest.tolist()))
+    
+    names = list(RECURRING_PERIODS)
+    for direction, amounts in (('debit', snapshot['debit']), ('credit', snapshot['credit'])):
+        rows = np.flatnonzero(selected & (amounts > 0))
+        if not len(rows):
+            continue
+        keys = (account[rows].astype(np.int64) << 32) | snapshot['merchant'][rows]
+        order = np.lexsort((day[rows], keys))
+        rows, keys = rows[order], keys[order]
+        days = day[rows].astype(np.int64)
+        
+        # One occurrence per group and day
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (days[1:] != days[:-1])])
+        cents = np.add.reduceat(amounts[rows], starts)
+        rows, keys, days = rows[starts], keys[starts], days[starts]
+        
+        new_group = np.r_[True, keys[1:] != keys[:-1]]
+        group = np.cumsum(new_group) - 1
+        count = int(group[-1]) + 1
+        occurrences = np.bincount(group, minlength=count)
+        firsts = np.flatnonzero(new_group)
+        lasts = np.r_[firsts[1:] - 1, len(rows) - 1]
+        
+        # Intervals between consecutive occurrences in the same group
+        same = ~new_group[1:]
+        intervals = (days[1:] - days[:-1])[same]
+        interval_group = group[1:][same]
+        median_interval = group_medians(intervals, interval_group, count)
+        
+        period = np.full(count, -1)
+        deviation = np.zeros(count)
+        for code, name in enumerate(names):
+            low, high, allowed = RECURRING_PERIODS[name]
+            fits = (median_interval >= low) & (median_interval <= high)
+            period[fits] = code
+            deviation[fits] = allowed
+        minimum = np.where(period == names.index('yearly'), 2, 3)
+        
+        regular = np.abs(intervals - median_interval[interval_group]) <= deviation[interval_group]
+        regular_share = np.bincount(interval_group, weights=regular, minlength=count) / np.maximum(occurrences - 1, 1)
+        median_amount = group_medians(cents, group, count)
+        steady = np.abs(cents - median_amount[group]) <= amount_tolerance * median_amount[group]
+        steady_share = np.bincount(group, weights=steady, minlength=count) / occurrences
+        
+        recurring = (
+            (period >= 0) & (occurrences >= minimum)
+            & (regular_share >= RECURRING_REGULARITY) & (steady_share >= RECURRING_REGULARITY)
+        )
+        amount_min = np.minimum.reduceat(cents, firsts)
+        amount_max = np.maximum.reduceat(cents, firsts)
+        
+        for index in np.flatnonzero(recurring).tolist():
+            row = rows[lasts[index]]
+            account_id = int(account[row])
+            name = names[period[index]]
+            last = date.fromordinal(int(days[lasts[index]]))
+            next_date = recurrence(last, name, median_interval[index], 1)
+            result[account_id].append({
+                'account_id': account_id,
+                'merchant': snapshot.merchants[snapshot['merchant'][row]],
+                'direction': direction,
+                'period': name,
+                'interval_days': round(float(median_interval[index]), 1),
+                'amount': round(float(median_amount[index]) / 100, 2),
+                'amount_min': int(amount_min[index]) / 100,
+                'amount_max': int(amount_max[index]) / 100,
+                'occurrences': int(occurrences[index]),
+                'first_date': date.fromordinal(int(days[firsts[index]])).strftime('%Y-%m-%d'),
+                'last_date': last.strftime('%Y-%m-%d'),
+                'next_date': next_date.strftime('%Y-%m-%d'),
+                'active': bool(next_date.toordinal() + deviation[index] >= newest[account_id]),
+                'category': snapshot.categories[snapshot['category'][row]]
+            })
+    
+    for items in result.values():
+        items.sort(key=lambda item: (item['direction'], -item['amount'], item['merchant']))
+    return result
+
+recurring_items = {}
+recurring_lock = threading.Lock()
+
+def get_recurring(user_id):
+    """The user's recurring items by account, re-detected only for accounts whose data changed"""
+    snapshot = get_snapshot(user_id)
+    with recurring_lock:
+        versions, items = recurring_items.get(user_id, ({}, {}))
+        changed = [account_id for account_id, version in snapshot.versions.items()
+                   if versions.get(account_id) != version]
+        if changed or len(items) != len(snapshot.versions):
+            items = {account_id: found for account_id, found in items.items()
+                     if account_id in snapshot.versions and account_id not in changed}
+            items.update(detect_recurring(snapshot, changed, app.config['RECURRING_AMOUNT_TOLERANCE']))
+            recurring_items[user_id] = (dict(snapshot.versions), items)
+        return items
+
+def recurring_request(items_by_account):
+    """The recurring items matching the account_id parameter; raises ValueError on a bad one"""
+    account_id = request.args.get('account_id')
+    if not account_id:
+        return [item for account_id in sorted(items_by_account) for item in items_by_account[account_id]]
+    if not account_id.isdigit() or int(account_id) not in items_by_account:
+        raise ValueError('Invalid account ID')
+    return items_by_account[int(account_id)]
+
+@app.route('/api/recurring', methods=['GET'])
+@login_required
+@cached_household_response
+def recurring_transactions():
+    """Recurring payments and credits: merchants that repeat at a steady interval and amount.
+    
+    Accepts account_id, direction (debit or credit) and active=1 to leave out
+    items that have stopped. Sorted by account, then largest amount first.
+    """
+    direction = request.args.get('direction')
+    if direction not in (None, 'debit', 'credit'):
+        return jsonify({'error': 'direction must be debit or credit'}), 400
+    try:
+        items = recurring_request(get_recurring(session['user_id']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    active_only = request.args.get('active', '').lower() in ('1', 'true', 'yes')
+    return jsonify([
+        item for item in items
+        if (direction is None or item['direction'] == direction) and (item['active'] or not active_only)
+    ])
+
+@app.route('/api/recurring/projection', methods=['GET'])
+@login_required
+@cached_household_response
+def recurring_projection():
+    """Expected recurring outgoings and income over the coming days.
+    
+    Every active item is projected forward from its last occurrence. Accepts
+    days (default 30, up to 366), start_date (default today) and account_id.
+    """
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'Invalid days'}), 400
+    if not 1 <= days <= 366:
+        return jsonify({'error': 'days must be between 1 and 366'}), 400
+    try:
+        start_date, _ = parse_date_range(request.args)
+        items = recurring_request(get_recurring(session['user_id']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    start_date = start_date or date.today()
+    end_date = start_date + timedelta(days=days - 1)
+    
+    events = []
+    totals = {'debit': 0, 'credit': 0}
+    for item in items:
+        if not item['active']:
+            continue
+        last = datetime.strptime(item['last_date'], '%Y-%m-%d').date()
+        n = 1
+        due = recurrence(last, item['period'], item['interval_days'], n)
+        while due <= end_date:
+            if due >= start_date:
+                totals[item['direction']] += round(item['amount'] * 100)
+                events.append({
+                    'date': due.strftime('%Y-%m-%d'),
+                    'account_id': item['account_id'],
+                    'merchant': item['merchant'],
+                    'direction': item['direction'],
+                    'amount': item['amount'],
+                    'category': item['category']
+                })
+            n += 1
+            due = recurrence(last, item['period'], item['interval_days'], n)
+    events.sort(key=lambda event: (event['date'], event['account_id'], event['merchant']))
+    
+    return jsonify({
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'outgoings': totals['debit'] / 100,
+        'income': totals['credit'] / 100,
+        'net': (totals['credit'] - totals['debit']) / 100,
+        'events': events
+    })
+
+def engine_options(config):
+    """SQLAlchemy engine options for the pool settings in config"""
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    }
+    if not config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT']
+        )
+    if config['DB_STATEMENT_TIMEOUT_MS'] and config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+def create_app(config=None):
+    """Configure the app, bind the database and start its services; gunicorn runs 'app:create_app()'.
+    
+    Settings come from the environment at import, then from the config
+    dict. Routes are registered on the module's app as it is imported, so
+    there is one app per process: later calls return it unchanged.
+    """
+    global response_cache, ingest_executor
+    if 'sqlalchemy' in app.extensions:
+        if config:
+            raise RuntimeError('create_app() already configured the app in this process')
+        return app
+    
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
+    
+    response_cache = create_response_cache()
+    ingest_executor = ThreadPoolExecutor(
+        max_workers=app.config['INGEST_WORKERS'],
+        thread_name_prefix='ingest'
+    )
+    profiler.interval = app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000
+    return app
+
 if __name__ == '__main__':
+    create_app()
     with app.app_context():
         db.create_all()
         # Create default user if not exists
@@ -603,4 +3998,5 @@ if __name__ == '__main__':
             )
             db.session.add(user)
             db.session.commit()
+    start_ingest_heartbeat()
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,373 @@
+"""Benchmark uploads, listing and analysis on synthetic bank exports.
+
+Usage:
+    python benchmark.py [--sizes 1000 100000 1000000] [--layouts current card loan]
+                        [--repeat 20] [--batch-files 8] [--batch-rows 20000]
+                        [--database-url URL]
+                        [--output benchmark-results.json] [--compare OLD.json]
+
+Generates exports in the layouts of the sample files (current accounts like
+Rahul Current.csv, credit cards like Platinum.csv and click.csv, loans like
+loan1.csv), uploads each one into a fresh account through /upload, then times
+/transactions and both analysis endpoints. Every request is timed cold (a new
+query string, so the response cache misses) and warm (the same URL again).
+
+It then imports --batch-files exports of --batch-rows rows twice, into fresh
+accounts: one after another through /upload, as the monthly routine did, and
+all at once through /upload/batch, whose parse pool has PARSE_WORKERS
+processes. The wall-clock ratio is reported as the batch speedup.
+
+Runs against a throwaway SQLite file unless --database-url points at a
+scratch PostgreSQL database. Never point it at the real budget database.
+Results are written as JSON; pass an earlier file to --compare to print how
+each number moved.
+
+The default sizes give the analysis response time against account size at
+1k, 100k and 1M rows. The 1M uploads take several minutes; for a quick
+check of a change, run with --sizes 10000 100000.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--layouts', nargs='+', choices=sorted(LAYOUTS), default=sorted(LAYOUTS))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch-files', type=int, default=8, help='0 skips the batch upload comparison')
+    parser.add_argument('--batch-rows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare')
+    return parser.parse_args()
+
+
+# Descriptions in the shapes the real exports use; {ref} becomes a number so
+# some descriptions repeat exactly and others are unique
+DESCRIPTIONS = [
+    'D/D Zurich Life', 'D/D AN POST TV LIC', 'D/D VODAFONE IRELAND',
+    'VDC-FOOD MAXX', 'VDC-SUPERVALU', 'VDC-TESCO STORES {ref}',
+    'VDP-APPLE.COM/BILL', 'VDP-HUMMGROUP', 'VDP-AMAZON.IE {ref}',
+    '*MOBI RB SAVE', '*MOBI RENT', '*MOBI CLICK',
+    'PYD*Grafton Cafe', 'PYD*GraftonBarbers', 'Just Eat Ireland L',
+    'Revolut**{ref}*', 'GOVERNMENT STAMP D', 'REVCOM0529{ref}',
+    'LN 9310124046{ref}', 'IE2504{ref}'
+]
+START_DATE = date(2020, 1, 1)
+
+
+def random_description():
+    return random.choice(DESCRIPTIONS).format(ref=random.randrange(10000))
+
+
+def format_amount(cents):
+    """Amounts the way the bank writes them: 4, 49.23 or 1,700.00"""
+    if cents % 100 == 0 and random.random() < 0.5:
+        return str(cents // 100)
+    return f'{cents // 100:,}.{cents % 100:02d}'
+
+
+def current_rows(count, days):
+    balance = 250000
+    account = '931012 - 40464424'
+    for i in range(count):
+        day = START_DATE + timedelta(days=i * days // count)
+        cents = random.randrange(100, 200000)
+        debit = random.random() < 0.8
+        balance += -cents if debit else cents
+        amount = format_amount(cents)
+        yield [
+            account, day.strftime('%d/%m/%Y'), random_description(), '', '',
+            amount if debit else '', '' if debit else amount,
+            f'{balance / 100:.2f}', 'EUR', 'Debit' if debit else 'Credit', amount, 'EUR'
+        ]
+
+
+def card_rows(count, days):
+    card = '4263 **** **** 1134'
+    for i in range(count):
+        day = START_DATE + timedelta(days=i * days // count)
+        amount = format_amount(random.randrange(100, 50000))
+        debit = random.random() < 0.95
+        yield [
+            card, day.strftime('%d/%m/%Y'), random_description(),
+            amount if debit else '  ', '  ' if debit else amount,
+            'EUR', 'Debit' if debit else 'Credit', amount, 'EUR'
+        ]
+
+
+def loan_rows(count, days):
+    for i in range(count):
+        day = START_DATE + timedelta(days=i * days // count)
+        yield [
+            'Loan1', day.strftime('%d/%m/%Y'), random_description(),
+            '', format_amount(random.randrange(1000, 100000)), '', 'Credit'
+        ]
+
+
+# layout -> (header line as the bank writes it, blank second row?, row generator)
+LAYOUTS = {
+    'current': (
+        'Posted Account, Posted Transactions Date, Description1, Description2, Description3, '
+        'Debit Amount, Credit Amount,Balance,Posted Currency,Transaction Type,Local Currency Amount,Local Currency',
+        False, current_rows
+    ),
+    'card': (
+        'Masked Card Number, Posted Transactions Date, Description, Debit Amount, Credit Amount, '
+        'Posted Currency, Transaction Type, Local Currency Amount, Local Currency',
+        True, card_rows
+    ),
+    'loan': (
+        'Masked Card Number, Posted Transactions Date, Description, Debit Amount, Credit Amount,'
+        'Balance,Transaction Type',
+        True, loan_rows
+    )
+}
+
+
+def write_export(path, layout, count):
+    """Write a synthetic export of `count` rows spread over about five years"""
+    header, blank_row, rows = LAYOUTS[layout]
+    with open(path, 'w', newline='') as f:
+        f.write(header + '\r\n')
+        if blank_row:
+            f.write(',' * header.count(',') + '\r\n')
+        csv.writer(f).writerows(rows(count, 5 * 365))
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    """Print each timing and throughput next to the same number from an earlier run"""
+    with open(path) as f:
+        previous = json.load(f)
+    old = {(case['layout'], case['rows']): case for case in previous['cases']}
+    print(f"\nCompared with {path} (commit {previous.get('commit')})")
+    for case in results['cases']:
+        before = old.get((case['layout'], case['rows']))
+        if not before:
+            continue
+        label = f"{case['layout']} {case['rows']:,}"
+        rate, old_rate = case['upload']['rows_per_second'], before['upload']['rows_per_second']
+        print(f"{label:>20} upload rows/s {old_rate:>12,.0f} -> {rate:>12,.0f} ({rate / old_rate:.2f}x)")
+        for name, timings in case['endpoints'].items():
+            if name not in before['endpoints']:
+                continue
+            for kind in ('cold', 'warm'):
+                new_ms = timings[kind]['p50_ms']
+                old_ms = before['endpoints'][name][kind]['p50_ms']
+                print(f"{label:>20} {name} {kind} p50 ms {old_ms:>9.2f} -> {new_ms:>9.2f} ({new_ms / old_ms:.2f}x)")
+
+
+def compare_batch_upload(app, client, user_id, workdir, args):
+    """Wall-clock seconds for the same exports through /upload one at a time and through one /upload/batch"""
+    from app import db, Account, get_parse_pool
+
+    # A running server starts its parse pool once per worker, not per
+    # upload, so start it before the clock does
+    if app.config['PARSE_WORKERS'] > 1:
+        list(get_parse_pool().map(abs, range(app.config['PARSE_WORKERS'])))
+
+    layouts = sorted(LAYOUTS)
+    paths = []
+    for i in range(args.batch_files):
+        path = os.path.join(workdir, f'batch-{i}.csv')
+        write_export(path, layouts[i % len(layouts)], args.batch_rows)
+        paths.append(path)
+
+    def fresh_accounts(run):
+        with app.app_context():
+            accounts = [Account(name=f'Batch {run} {i}', user_id=user_id) for i in range(len(paths))]
+            db.session.add_all(accounts)
+            db.session.commit()
+            return [account.id for account in accounts]
+
+    serial_accounts = fresh_accounts('serial')
+    started = time.perf_counter()
+    for path, account_id in zip(paths, serial_accounts):
+        with open(path, 'rb') as f:
+            response = client.post('/upload', data={
+                'account_id': str(account_id), 'wait': '1', 'file': (f, os.path.basename(path))
+            }, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    serial_seconds = time.perf_counter() - started
+
+    batch_accounts = fresh_accounts('batch')
+    mapping = {os.path.basename(path): account_id for path, account_id in zip(paths, batch_accounts)}
+    files = [open(path, 'rb') for path in paths]
+    try:
+        started = time.perf_counter()
+        response = client.post('/upload/batch', data={
+            'mapping': json.dumps(mapping),
+            'files': [(f, os.path.basename(path)) for f, path in zip(files, paths)]
+        }, content_type='multipart/form-data')
+        batch_seconds = time.perf_counter() - started
+    finally:
+        for f in files:
+            f.close()
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    for path in paths:
+        os.remove(path)
+    return {
+        'files': len(paths),
+        'rows_per_file': args.batch_rows,
+        'parse_workers': app.config['PARSE_WORKERS'],
+        'serial_seconds': round(serial_seconds, 3),
+        'batch_seconds': round(batch_seconds, 3),
+        'speedup': round(serial_seconds / batch_seconds, 2)
+    }
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp()
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+
+    # Import after DATABASE_URL is set, the app reads it at import time
+    from app import create_app, db, User, Account, peak_rss_kb, query_counter
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(username=f'benchmark-{int(time.time())}', password_hash='-')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        database = db.engine.dialect.name
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    def timed_get(url):
+        """Wall-clock milliseconds and SQL statements for one GET"""
+        queries_before = getattr(query_counter, 'count', 0)
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = (time.perf_counter() - started) * 1000
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return elapsed, getattr(query_counter, 'count', 0) - queries_before
+
+    def measure(url):
+        stats = {}
+        for kind in ('cold', 'warm'):
+            timings, queries = [], []
+            for run in range(args.repeat):
+                # A query string the cache has not seen forces the view to run
+                request_url = f'{url}&run={run}' if kind == 'cold' else url
+                elapsed, count = timed_get(request_url)
+                timings.append(elapsed)
+                queries.append(count)
+            stats[kind] = {
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'mean_ms': round(statistics.mean(timings), 3),
+                'queries': max(queries)
+            }
+        return stats
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'database': database,
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'cases': []
+    }
+
+    print(f"{'layout':>8} {'rows':>10} {'upload rows/s':>14} {'queries':>8} "
+          f"{'list p50':>9} {'category p50':>13} {'monthly p50':>12} {'peak MB':>8}")
+    for size in args.sizes:
+        for layout in args.layouts:
+            path = os.path.join(workdir, f'{layout}-{size}.csv')
+            write_export(path, layout, size)
+
+            with app.app_context():
+                account = Account(name=f'Benchmark {layout} {size}', user_id=user_id)
+                db.session.add(account)
+                db.session.commit()
+                account_id = account.id
+
+            started = time.perf_counter()
+            with open(path, 'rb') as f:
+                response = client.post('/upload', data={
+                    'account_id': str(account_id), 'wait': '1', 'file': (f, f'{layout}.csv')
+                }, content_type='multipart/form-data')
+            upload_seconds = time.perf_counter() - started
+            assert response.status_code == 200, response.get_data(as_text=True)
+            upload = response.get_json()
+
+            endpoints = {
+                'transactions': f'/transactions?account_id={account_id}&limit=100',
+                'transactions_filtered': f'/transactions?account_id={account_id}&limit=100&min_amount=50&q=MOBI',
+                'spending_by_category': f'/api/analysis/spending-by-category?account_id={account_id}',
+                'monthly_spending': f'/api/analysis/monthly-spending?account_id={account_id}'
+            }
+            case = {
+                'layout': layout,
+                'rows': size,
+                'file_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+                'upload': {
+                    'seconds': round(upload_seconds, 3),
+                    'rows_per_second': round(size / upload_seconds),
+                    'inserted': upload['transactions_count'],
+                    'queries': upload['db_queries']
+                },
+                'endpoints': {name: measure(url) for name, url in endpoints.items()},
+                'peak_rss_kb': peak_rss_kb()
+            }
+            results['cases'].append(case)
+            os.remove(path)
+
+            cold = {name: stats['cold']['p50_ms'] for name, stats in case['endpoints'].items()}
+            peak_mb = (case['peak_rss_kb'] or 0) / 1024
+            print(f"{layout:>8} {size:>10,} {case['upload']['rows_per_second']:>14,} {upload['db_queries']:>8} "
+                  f"{cold['transactions']:>9.1f} {cold['spending_by_category']:>13.1f} "
+                  f"{cold['monthly_spending']:>12.1f} {peak_mb:>8.0f}")
+
+    if args.batch_files:
+        results['batch_upload'] = compare_batch_upload(app, client, user_id, workdir, args)
+        batch = results['batch_upload']
+        print(f"\n{batch['files']} files of {batch['rows_per_file']:,} rows: /upload one by one "
+              f"{batch['serial_seconds']:.2f}s, /upload/batch {batch['batch_seconds']:.2f}s "
+              f"({batch['speedup']:.2f}x, {batch['parse_workers']} parse workers)")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
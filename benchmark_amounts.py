@@ -0,0 +1,164 @@
+"""Measure amount parsing throughput and check rollups add up to the cent.
+
+Usage:
+    python benchmark_amounts.py [--values 1000000] [--rows 200000] [--database-url URL]
+
+The rollup check inserts synthetic transactions into a throwaway SQLite file
+(or a scratch PostgreSQL database), then compares the monthly rollups and the
+analysis endpoint totals with exact integer-cent sums computed in Python.
+Exits with status 1 if any total is off by a cent. tests/test_rollups.py
+runs the same check on a small fixed set of amounts.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--values', type=int, default=1000000)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--database-url')
+    return parser.parse_args()
+
+
+def legacy_parse_float(value_str):
+    """The float parser amounts went through before NUMERIC storage"""
+    if not value_str or not isinstance(value_str, str):
+        return 0.0
+    clean_value = value_str.replace('$', '').replace('£', '').replace('€', '').replace(',', '')
+    clean_value = clean_value.replace('(', '-').replace(')', '')
+    try:
+        return float(clean_value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def random_amount_string():
+    cents = random.randrange(1, 500000)
+    text = f'{cents // 100:,}.{cents % 100:02d}'
+    roll = random.random()
+    if roll < 0.1:
+        return f'({text})'
+    if roll < 0.2:
+        return f'€{text}'
+    if roll < 0.25:
+        return '  '
+    return text
+
+
+def time_parser(name, parser, values):
+    started = time.perf_counter()
+    for value in values:
+        parser(value)
+    elapsed = time.perf_counter() - started
+    print(f'{name:>20}: {len(values) / elapsed:>12,.0f} values/sec')
+
+
+def import_amounts(entries, batch_size=5000):
+    """Import (posted_date, amount string) pairs into a new user's account as uploads do.
+
+    Each batch goes through write_transaction_batch and then its rollup
+    deltas, with categories taken in turn from CATEGORIES. Call inside an
+    app context. Returns the user id, the account id and the exact
+    integer-cent (spending, income) totals for each month, in month order.
+    """
+    from app import (
+        db, User, Account, UploadedFile, CATEGORIES,
+        add_rollup_deltas, apply_rollup_deltas, chunked, parse_amount, to_cents, write_transaction_batch
+    )
+    user = User(username=f'benchmark-{uuid.uuid4().hex}', password_hash='-')
+    db.session.add(user)
+    db.session.flush()
+    account = Account(name='Benchmark', user_id=user.id)
+    db.session.add(account)
+    db.session.flush()
+    uploaded_file = UploadedFile(filename='benchmark.csv', account_id=account.id, user_id=user.id)
+    db.session.add(uploaded_file)
+    db.session.flush()
+
+    expected = {}
+    rows = []
+    for i, (posted_date, amount_str) in enumerate(entries):
+        amount = parse_amount(amount_str)
+        debit = amount if amount > 0 else parse_amount('0')
+        credit = -amount if amount < 0 else parse_amount('0')
+        rows.append({
+            'posted_date': posted_date,
+            'description1': 'BENCHMARK',
+            'debit_amount': debit,
+            'credit_amount': credit,
+            'balance': None,
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'file_id': uploaded_file.id,
+            'account_id': account.id
+        })
+        totals = expected.setdefault(posted_date.strftime('%Y-%m'), [0, 0])
+        totals[0] += to_cents(debit)
+        totals[1] += to_cents(credit)
+
+    for batch in chunked(rows, batch_size):
+        write_transaction_batch(batch)
+        deltas = {}
+        add_rollup_deltas(deltas, batch)
+        apply_rollup_deltas(account.id, deltas)
+    db.session.commit()
+
+    months = sorted(expected)
+    return user.id, account.id, ([expected[month][0] for month in months], [expected[month][1] for month in months])
+
+
+def endpoint_totals(app, user_id, account_id):
+    """(spending, income) in cents for each month from the monthly-spending endpoint"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    data = client.get(f'/api/analysis/monthly-spending?account_id={account_id}').get_json()
+    return [round(value * 100) for value in data['spending']], [round(value * 100) for value in data['income']]
+
+
+def main():
+    args = parse_args()
+    random.seed(7)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    # Import after DATABASE_URL is set, the app reads it at import time
+    from app import create_app, db, check_rollups, parse_amount, parse_cents
+    app = create_app()
+
+    values = [random_amount_string() for _ in range(args.values)]
+    print(f'Parsing {len(values):,} amount strings')
+    time_parser('legacy float', legacy_parse_float, values)
+    time_parser('parse_cents', parse_cents, values)
+    time_parser('parse_amount', parse_amount, values)
+
+    print(f'\nChecking rollups over {args.rows:,} transactions')
+    start = date(2020, 1, 1)
+    entries = [
+        (start + timedelta(days=random.randrange(4 * 365)), random_amount_string())
+        for _ in range(args.rows)
+    ]
+    with app.app_context():
+        db.create_all()
+        user_id, account_id, expected = import_amounts(entries)
+        failures = len(check_rollups([account_id]))
+    print(f'{"rollup rows":>20}: {"ok" if not failures else f"{failures} mismatched"}')
+
+    endpoint_ok = endpoint_totals(app, user_id, account_id) == expected
+    print(f'{"monthly endpoint":>20}: {"ok" if endpoint_ok else "totals differ"}')
+
+    if failures or not endpoint_ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Gunicorn settings for the web process (see Procfile).
+
+Workers are threaded (gthread) by default, so a slow upload holds one thread
+rather than a whole process while the other threads keep serving. The database
+pool is per process, so keep DB_POOL_SIZE at least GUNICORN_THREADS plus
+INGEST_WORKERS.
+
+GUNICORN_WORKER_CLASS=gevent is also supported; it needs the gevent and
+psycogreen packages, and post_fork makes psycopg2 cooperative. The app is
+then never preloaded: it has to be imported after the worker monkey-patches,
+or the per-request query counter and profiler stay per OS thread and
+concurrent greenlets share them.
+"""
+import os
+import sys
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '60'))
+keepalive = 5
+
+# Import the app once in the master; workers fork from it instead of each
+# paying the import on start. Not with gevent, see above.
+preload_app = worker_class != 'gevent' and os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    # Connections opened in the master must not be shared with the workers.
+    # Without preload the app is imported later, by the worker itself;
+    # importing it here would do so before gevent patches.
+    module = sys.modules.get('app')
+    if module and 'sqlalchemy' in module.app.extensions:
+        with module.app.app_context():
+            module.db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Stamps this worker's import jobs and fails ones whose worker died
+    from app import start_ingest_heartbeat
+    start_ingest_heartbeat()
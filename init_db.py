@@ -1,6 +1,8 @@
-from app import app, db, User, Account, CategoryMapping
+from app import create_app, db, User, Account, CategoryMapping
 from werkzeug.security import generate_password_hash
 
+app = create_app()
+
 # Create tables
 with app.app_context():
     print("Creating database tables...")
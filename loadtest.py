@@ -0,0 +1,271 @@
+"""Load test: requests/sec and latency under concurrent uploads and analysis reads.
+
+Usage:
+    python loadtest.py [--duration 30] [--readers 8] [--uploaders 2] [--rows 2000]
+                       [--database-url URL | --url http://host:port]
+                       [--output loadtest-results.json]
+
+Without --url it starts gunicorn with gunicorn.conf.py on a free port against
+a throwaway SQLite file, or against --database-url, which should be a scratch
+PostgreSQL database; SQLite serialises the concurrent writes. Worker settings
+come from the usual GUNICORN_* and DB_POOL_* variables, so runs with different
+settings can be compared. With --url it drives a server that is already
+running and logs in with --username and --password. Never point it at real
+budget data.
+
+Readers cycle through the listing and analysis endpoints with a fresh query
+string on every request, so each one runs its queries rather than hitting the
+response cache. Uploaders post synthetic exports (see benchmark.py) with
+wait=1, so each upload holds a worker thread for its whole import.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+from benchmark import git_commit, percentile, write_export
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--uploaders', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=2000, help='rows per uploaded export')
+    parser.add_argument('--accounts', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url')
+    parser.add_argument('--database-url')
+    parser.add_argument('--username', default='rahulann')
+    parser.add_argument('--password', default='annrahul2024')
+    parser.add_argument('--output', default='loadtest-results.json')
+    return parser.parse_args()
+
+
+# Endpoints the readers cycle through; {account} is one of the test accounts
+READ_ENDPOINTS = {
+    'transactions': '/transactions?account_id={account}&limit=100',
+    'spending_by_category': '/api/analysis/spending-by-category?account_id={account}',
+    'monthly_spending': '/api/analysis/monthly-spending?account_id={account}',
+    'household_monthly': '/api/analysis/household/monthly-spending?window_days=3',
+    'group_by': '/api/analytics/group-by?by=month,category'
+}
+
+
+class Client:
+    """HTTP requests against the server, sharing one session cookie across threads"""
+
+    def __init__(self, base_url, cookies):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+
+    def request(self, path, data=None, content_type=None):
+        headers = {'Content-Type': content_type} if content_type else {}
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        with self.opener.open(request, timeout=600) as response:
+            return response.status, response.read()
+
+
+def multipart(fields, filename, content):
+    """A multipart/form-data body with the given fields and one CSV file"""
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'.encode() + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def export_bytes(workdir, rows):
+    """A fresh synthetic current-account export"""
+    path = os.path.join(workdir, f'{uuid.uuid4().hex}.csv')
+    write_export(path, 'current', rows)
+    with open(path, 'rb') as f:
+        content = f.read()
+    os.remove(path)
+    return content
+
+
+def upload(client, workdir, account_id, rows):
+    body, content_type = multipart({'account_id': account_id, 'wait': '1'}, 'loadtest.csv', export_bytes(workdir, rows))
+    status, payload = client.request('/upload', body, content_type)
+    return json.loads(payload)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url, workdir):
+    """Create the tables, then start gunicorn as the Procfile does; returns (process, url, log path)"""
+    os.environ['DATABASE_URL'] = database_url
+    # Import after DATABASE_URL is set, the app reads it at import time
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+    port = free_port()
+    log_path = os.path.join(workdir, 'gunicorn.log')
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:create_app()'],
+            cwd=root, env=dict(os.environ, PORT=str(port)), stdout=log, stderr=subprocess.STDOUT
+        )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'gunicorn exited with status {server.returncode}, see {log_path}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, f'http://127.0.0.1:{port}', log_path
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f'gunicorn did not start listening within a minute, see {log_path}')
+
+
+def summarise(samples, seconds):
+    """Throughput and latency of (name, milliseconds, ok) samples"""
+    timings = [elapsed for _, elapsed, ok in samples if ok]
+    stats = {
+        'requests': len(samples),
+        'errors': len(samples) - len(timings),
+        'requests_per_second': round(len(samples) / seconds, 2)
+    }
+    if timings:
+        stats.update({
+            'p50_ms': round(percentile(timings, 0.50), 1),
+            'p99_ms': round(percentile(timings, 0.99), 1),
+            'mean_ms': round(statistics.mean(timings), 1)
+        })
+    return stats
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp()
+
+    server = log_path = None
+    url = args.url
+    if not url:
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+        server, url, log_path = start_server(database_url, workdir)
+
+    try:
+        client = Client(url, http.cookiejar.CookieJar())
+        client.request('/login', urllib.parse.urlencode({
+            'username': args.username, 'password': args.password
+        }).encode(), 'application/x-www-form-urlencoded')
+
+        # Accounts with data in them before the clock starts
+        run = int(time.time())
+        accounts = []
+        for i in range(args.accounts):
+            _, payload = client.request('/accounts', urllib.parse.urlencode({
+                'name': f'Load test {run} {i + 1}'
+            }).encode(), 'application/x-www-form-urlencoded')
+            account_id = json.loads(payload)['account_id']
+            upload(client, workdir, account_id, args.rows)
+            accounts.append(account_id)
+
+        samples = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+
+        def record(name, started, ok):
+            with lock:
+                samples.append((name, (time.perf_counter() - started) * 1000, ok))
+
+        def reader():
+            while time.monotonic() < deadline:
+                name, path = random.choice(list(READ_ENDPOINTS.items()))
+                path = path.format(account=random.choice(accounts))
+                started = time.perf_counter()
+                try:
+                    status, _ = client.request(f'{path}&run={uuid.uuid4().hex}')
+                    record(name, started, status == 200)
+                except (urllib.error.URLError, OSError):
+                    record(name, started, False)
+
+        def uploader():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    upload(client, workdir, random.choice(accounts), args.rows)
+                    record('upload', started, True)
+                except (urllib.error.URLError, OSError, ValueError):
+                    record('upload', started, False)
+
+        threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+        threads += [threading.Thread(target=uploader) for _ in range(args.uploaders)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Uploads in flight at the deadline still count, so use the real span
+        seconds = time.monotonic() - started
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    reads = [sample for sample in samples if sample[0] != 'upload']
+    uploads = [sample for sample in samples if sample[0] == 'upload']
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'url': args.url,
+        'database': args.database_url if args.database_url else (None if args.url else 'sqlite'),
+        'settings': {name: os.environ[name] for name in sorted(os.environ)
+                     if name.startswith(('GUNICORN_', 'DB_POOL_', 'WEB_CONCURRENCY', 'INGEST_WORKERS'))},
+        'readers': args.readers,
+        'uploaders': args.uploaders,
+        'rows_per_upload': args.rows,
+        'seconds': round(seconds, 2),
+        'total': summarise(samples, seconds),
+        'reads': summarise(reads, seconds),
+        'uploads': summarise(uploads, seconds),
+        'endpoints': {name: summarise([s for s in reads if s[0] == name], seconds) for name in READ_ENDPOINTS}
+    }
+
+    print(f"{'':>22} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    rows = [('all', results['total']), ('reads', results['reads']), ('uploads', results['uploads'])]
+    rows += list(results['endpoints'].items())
+    for name, stats in rows:
+        print(f"{name:>22} {stats['requests']:>9} {stats['errors']:>7} {stats['requests_per_second']:>8.2f} "
+              f"{stats.get('p50_ms', float('nan')):>9.1f} {stats.get('p99_ms', float('nan')):>9.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.output}')
+    if log_path and results['total']['errors']:
+        print(f'Server log: {log_path}')
+
+
+if __name__ == '__main__':
+    main()
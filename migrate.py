@@ -0,0 +1,263 @@
+"""Apply schema migrations to an existing database without dropping data.
+
+Usage:
+    python migrate.py           # apply pending migrations
+    python migrate.py --status  # list migrations and whether they have run
+
+Each migration runs once and is recorded in the schema_migration table.
+Most only add tables, columns and indexes, and indexes are built
+CONCURRENTLY on PostgreSQL, so they can run against production while the
+app is serving. A few also rewrite column types or existing rows
+(store_amounts_as_numeric, the fingerprint backfill, clear_missing_balances);
+their docstrings say what they change.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, func, inspect, select, update
+
+from app import (
+    create_app, db, Account, Transaction, CategoryMapping, CategoryRule, MonthlyRollup, IngestJob,
+    SEARCH_TEXT_SQL, assign_fingerprints, chunked, rebuild_rollups
+)
+
+migration_table = Table(
+    'schema_migration',
+    MetaData(),
+    Column('id', String(100), primary_key=True),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(step):
+    """Register a migration; they run in the order they are defined"""
+    MIGRATIONS.append(step)
+    return step
+
+
+def create_index(model, name):
+    """Create one of a model's declared indexes, partial ones with their WHERE clause, if it does not exist yet"""
+    index = next(i for i in model.__table__.indexes if i.name == name)
+    preparer = db.engine.dialect.identifier_preparer
+    columns = ', '.join(preparer.quote(column.name) for column in index.columns)
+    table = preparer.format_table(model.__table__)
+    unique = 'UNIQUE ' if index.unique else ''
+
+    # CONCURRENTLY avoids locking out writes but cannot run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+        options = index.dialect_options[conn.dialect.name] if conn.dialect.name in ('postgresql', 'sqlite') else {}
+        where = f" WHERE {options['where']}" if options.get('where') is not None else ''
+        conn.exec_driver_sql(
+            f'CREATE {unique}INDEX {concurrently}IF NOT EXISTS {preparer.quote(index.name)} ON {table} ({columns}){where}'
+        )
+
+
+def add_column(model, name):
+    """Add one of a model's columns to its existing table if it is missing"""
+    table = model.__table__
+    if name in {column['name'] for column in inspect(db.engine).get_columns(table.name)}:
+        return
+
+    preparer = db.engine.dialect.identifier_preparer
+    column = table.c[name]
+    definition = column.type.compile(db.engine.dialect)
+    if column.server_default is not None:
+        definition += f' DEFAULT {column.server_default.arg}'
+        if not column.nullable:
+            definition += ' NOT NULL'
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(
+            f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(name)} {definition}'
+        )
+
+
+@migration
+def add_transaction_query_indexes():
+    """Composite indexes for per-account listing and analysis queries"""
+    create_index(Transaction, 'ix_transaction_account_posted_date')
+    create_index(Transaction, 'ix_transaction_account_category')
+
+
+@migration
+def add_category_mapping_lookup_index():
+    """Composite index for keyword lookups ordered by use count"""
+    create_index(CategoryMapping, 'ix_category_mapping_user_keyword_count')
+
+
+@migration
+def add_monthly_rollup_table():
+    """Pre-aggregated (account, month, category) totals, backfilled from transactions"""
+    MonthlyRollup.__table__.create(db.engine, checkfirst=True)
+    rebuild_rollups()
+    db.session.commit()
+
+
+@migration
+def add_transaction_fingerprints():
+    """Content fingerprints for duplicate detection, backfilled for existing rows"""
+    add_column(Transaction, 'fingerprint')
+
+    # Existing duplicates get ordinals in id order within their account,
+    # the same way repeats within one file do on upload
+    columns = [
+        Transaction.id, Transaction.account_id, Transaction.posted_date,
+        Transaction.description1, Transaction.description2, Transaction.description3,
+        Transaction.debit_amount, Transaction.credit_amount, Transaction.balance
+    ]
+    rows = db.session.execute(
+        select(*columns).where(Transaction.fingerprint.is_(None))
+        .order_by(Transaction.account_id, Transaction.id)
+        .execution_options(yield_per=10000)
+    )
+    fingerprinted = assign_fingerprints(row._asdict() for row in rows)
+
+    table = Transaction.__table__
+    statement = update(table).where(table.c.id == bindparam('row_id')).values(fingerprint=bindparam('row_fingerprint'))
+    with db.engine.begin() as conn:
+        for batch in chunked(fingerprinted, 10000):
+            conn.execute(statement, [{'row_id': t['id'], 'row_fingerprint': t['fingerprint']} for t in batch])
+    db.session.commit()
+
+    create_index(Transaction, 'ix_transaction_fingerprint')
+
+
+@migration
+def add_ingest_job_table():
+    """Background import jobs"""
+    IngestJob.__table__.create(db.engine, checkfirst=True)
+
+
+@migration
+def store_amounts_as_numeric():
+    """Exact NUMERIC amounts instead of floating point, then re-sum the rollups.
+
+    Rewrites the tables on PostgreSQL, so run it in a quiet period. SQLite has
+    no fixed-point storage; there the app rounds values to the cent instead.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(
+                'ALTER TABLE "transaction" '
+                'ALTER COLUMN debit_amount TYPE NUMERIC(12, 2) USING round(debit_amount::numeric, 2), '
+                'ALTER COLUMN credit_amount TYPE NUMERIC(12, 2) USING round(credit_amount::numeric, 2), '
+                'ALTER COLUMN balance TYPE NUMERIC(12, 2) USING round(balance::numeric, 2)'
+            )
+            conn.exec_driver_sql(
+                'ALTER TABLE monthly_rollup '
+                'ALTER COLUMN spending TYPE NUMERIC(14, 2) USING round(spending::numeric, 2), '
+                'ALTER COLUMN income TYPE NUMERIC(14, 2) USING round(income::numeric, 2)'
+            )
+    rebuild_rollups()
+    db.session.commit()
+
+
+@migration
+def add_account_data_version():
+    """Per-account version counter behind response caching and ETags"""
+    add_column(Account, 'data_version')
+
+
+@migration
+def add_category_rule_table():
+    """User-defined categorisation rules"""
+    CategoryRule.__table__.create(db.engine, checkfirst=True)
+
+
+@migration
+def add_transaction_search_index():
+    """Trigram index behind description search and the q filter.
+
+    PostgreSQL only; needs the pg_trgm extension, which the database owner can
+    create. Other databases search an in-process index instead.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        conn.exec_driver_sql(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_search_trgm '
+            f'ON "transaction" USING gin (({SEARCH_TEXT_SQL}) gin_trgm_ops)'
+        )
+
+
+@migration
+def add_transaction_balance_index():
+    """Partial index behind the newest balance on the accounts summary"""
+    create_index(Transaction, 'ix_transaction_account_balance')
+
+
+@migration
+def clear_missing_balances():
+    """NULL rather than 0.00 balances on rows from exports without a balance column.
+
+    Imports used to store a missing balance as 0.00, and which files came
+    from such exports was not recorded. This guesses: a file where every row
+    has a zero balance is taken to be one of them. An export that does have
+    a Balance column but really was at 0.00 on every row gets NULL balances
+    as well, so its account shows no balance rather than 0.00.
+    """
+    table = Transaction.__table__
+    accounts = Account.__table__
+    no_balance_files = (
+        select(table.c.file_id)
+        .group_by(table.c.file_id)
+        .having(func.max(func.abs(table.c.balance)) == 0)
+    )
+    with db.engine.begin() as conn:
+        account_ids = [account_id for account_id, in conn.execute(
+            select(table.c.account_id).where(table.c.file_id.in_(no_balance_files)).distinct()
+        )]
+        conn.execute(
+            update(table).where(table.c.file_id.in_(no_balance_files), table.c.balance == 0).values(balance=None)
+        )
+        # Cached responses show the old balances
+        conn.execute(
+            update(accounts).where(accounts.c.id.in_(account_ids)).values(data_version=accounts.c.data_version + 1)
+        )
+
+
+@migration
+def add_ingest_job_heartbeat():
+    """Heartbeat on background import jobs, so jobs whose worker died can be failed"""
+    add_column(IngestJob, 'heartbeat_at')
+
+
+def applied_migrations():
+    migration_table.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        return {row.id for row in conn.execute(select(migration_table.c.id))}
+
+
+def main():
+    # Index builds and backfills can outlast the statement timeout set for requests
+    app = create_app({'DB_STATEMENT_TIMEOUT_MS': 0})
+    with app.app_context():
+        # Tables that do not exist yet (fresh database) are created whole
+        db.create_all()
+        applied = applied_migrations()
+
+        if '--status' in sys.argv:
+            for step in MIGRATIONS:
+                state = 'applied' if step.__name__ in applied else 'pending'
+                print(f"{state:8} {step.__name__}")
+            return
+
+        pending = [step for step in MIGRATIONS if step.__name__ not in applied]
+        if not pending:
+            print("Database is up to date")
+            return
+
+        for step in pending:
+            print(f"Applying {step.__name__}...")
+            step()
+            with db.engine.begin() as conn:
+                conn.execute(migration_table.insert().values(id=step.__name__, applied_at=datetime.utcnow()))
+
+        print("Migrations complete!")
+
+
+if __name__ == '__main__':
+    main()
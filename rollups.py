@@ -0,0 +1,43 @@
+"""Maintain the monthly_rollup table behind the analysis endpoints.
+
+Usage:
+    python rollups.py rebuild [ACCOUNT_ID ...]  # recompute from transactions
+    python rollups.py check [ACCOUNT_ID ...]    # compare rollups with transactions
+
+Both default to every account. check exits with status 1 on any mismatch.
+"""
+import sys
+
+from app import create_app, db, check_rollups, rebuild_rollups
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild', 'check'):
+        print(__doc__)
+        sys.exit(2)
+
+    command = sys.argv[1]
+    account_ids = [int(arg) for arg in sys.argv[2:]] or None
+
+    app = create_app()
+    with app.app_context():
+        if command == 'rebuild':
+            print("Rebuilding rollups...")
+            rebuild_rollups(account_ids)
+            db.session.commit()
+            print("Rollups rebuilt!")
+            return
+
+        mismatches = check_rollups(account_ids)
+        for mismatch in mismatches:
+            account_id, month, category = mismatch['key']
+            print(f"account {account_id} {month or '(no date)'} {category}: "
+                  f"expected {mismatch['expected']}, found {mismatch['actual']}")
+        if mismatches:
+            print(f"{len(mismatches)} rollup rows are out of date; run 'python rollups.py rebuild'")
+            sys.exit(1)
+        print("Rollups match the transaction table")
+
+
+if __name__ == '__main__':
+    main()
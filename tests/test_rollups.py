@@ -0,0 +1,50 @@
+"""Monthly rollups and the analysis endpoint must add up to the cent.
+
+Runs against a throwaway SQLite file: python -m pytest
+"""
+import os
+import tempfile
+from datetime import date
+
+import pytest
+
+# The app reads DATABASE_URL at import time
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+from app import create_app, db, check_rollups  # noqa: E402
+from benchmark_amounts import endpoint_totals, import_amounts  # noqa: E402
+
+# Amount strings in the formats bank exports use: thousands separators,
+# currency symbols, accounting negatives, blanks, and sums that floats miss
+AMOUNTS = [
+    '0.10', '0.20', '1,234.56', '(12.30)', '€7.05', '£19.99', '  ', '0.30',
+    '1,000,000.01', '(0.01)', '33.33', '66.67', '$2,500.00', '(1,234.55)', '0.07'
+]
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture(scope='module')
+def imported(app):
+    """The amounts spread over three months and imported in two batches"""
+    entries = [(date(2025, 1 + i % 3, 1 + i), amount) for i, amount in enumerate(AMOUNTS)]
+    with app.app_context():
+        return import_amounts(entries, batch_size=8)
+
+
+def test_rollups_match_transactions(app, imported):
+    _, account_id, _ = imported
+    with app.app_context():
+        assert check_rollups([account_id]) == []
+
+
+def test_monthly_endpoint_totals_are_exact(app, imported):
+    user_id, account_id, expected = imported
+    assert len(expected[0]) == 3
+    assert endpoint_totals(app, user_id, account_id) == expected